@@ -0,0 +1,46 @@
+"""solve time and peak memory of the Boggle solver by board size
+
+    python benchmarks/boggle_scaling.py [--sizes 4 5 6 8 12 16] [--boards N]
+"""
+
+import statistics
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from hashamatic.command.boggle import Boggle
+from hashamatic.lexicon import get_lexicon
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 5, 6, 8, 12, 16, 24])
+    parser.add_argument("--boards", type=int, default=5)
+    parser.add_argument("--game", default="big")
+    parser.add_argument("--minlen", type=int, default=3)
+    args = parser.parse_args()
+
+    get_lexicon()  # don't charge the first board for opening the lexicon
+
+    print(f"{'size':>7} {'cells':>6} {'words':>6} {'mean s':>9} {'max s':>9} {'peak KiB':>9}")
+    for size in args.sizes:
+        times = []
+        words = []
+        peak = 0
+        for _ in range(args.boards):
+            game = Boggle(dice=args.game, size=(size, size))
+            tracemalloc.start()
+            start = time.perf_counter()
+            found = game.solve(args.minlen)
+            times.append(time.perf_counter() - start)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            words.append(len(found))
+        print(
+            f"{size:>3}x{size:<3} {size * size:>6} {int(statistics.mean(words)):>6} "
+            f"{statistics.mean(times):>9.4f} {max(times):>9.4f} {peak / 1024:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""compare the lexicon solver against the exhaustive per-word solver
+
+    python benchmarks/boggle_solver.py [--boards N] [--minlen N]
+"""
+
+import time
+from argparse import ArgumentParser
+from typing import List, Set
+
+from hashamatic.command.boggle import Boggle
+from hashamatic.lexicon import get_lexicon
+
+
+def exhaustive(game: Boggle, words: List[str], minlen: int) -> Set[str]:
+    """the original solver: one board search per dictionary word"""
+    board = [list(x) for x in game.grid]
+    return {x for x in words if len(x) >= minlen and Boggle.exist(board, x)}
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--boards", type=int, default=3)
+    parser.add_argument("--minlen", type=int, default=3)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    lexicon = get_lexicon()
+    print(f"lexicon load: {time.perf_counter() - start:.3f}s")
+    words = list(lexicon.words())
+
+    for dice in ["standard", "super"]:
+        for _ in range(args.boards):
+            game = Boggle(dice=dice)
+
+            start = time.perf_counter()
+            fast = game.solve(args.minlen)
+            t_fast = time.perf_counter() - start
+
+            start = time.perf_counter()
+            slow = exhaustive(game, words, args.minlen)
+            t_slow = time.perf_counter() - start
+
+            status = "ok" if fast == slow else "MISMATCH"
+            print(
+                f"{dice:8} {''.join(game.grid)} words={len(fast):4} "
+                f"lexicon={t_fast:.4f}s exhaustive={t_slow:.3f}s {status}"
+            )
+            if fast != slow:
+                print(f"  lexicon only: {sorted(fast - slow)}")
+                print(f"  exhaustive only: {sorted(slow - fast)}")
+
+
+if __name__ == "__main__":
+    main()
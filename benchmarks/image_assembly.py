@@ -0,0 +1,97 @@
+"""compare per-pixel ImageDraw.point assembly against array_image
+for the Plasma and Caves generators
+
+    python benchmarks/image_assembly.py [--sizes 256 512 1024] [--repeat N]
+"""
+
+import collections
+import random
+import time
+from argparse import ArgumentParser
+from typing import Dict, Tuple
+
+import numpy as np
+
+from PIL import ImageDraw
+from PIL.Image import Image
+from PIL.Image import new as NewImage
+
+from hashamatic.command.caves import FractalCaves
+from hashamatic.command.imaging import array_image
+from hashamatic.command.plasma import FractalMap
+
+
+def legacy_plasma(heights) -> Image:
+    """the original FractalMap.render loop, one draw.point per pixel"""
+    _, rows, cols = heights.shape
+    img = NewImage("RGB", (cols, rows))
+    draw = ImageDraw.Draw(img)
+    red, green, blue = heights.tolist()
+    for y in range(rows):
+        for x in range(cols):
+            draw.point([(x, y)], (int(red[y][x]), int(green[y][x]), int(blue[y][x])))
+    return img
+
+
+def legacy_land(caves: FractalCaves) -> Dict[Tuple[int, int], bool]:
+    """the land as the original defaultdict of (x, y) points"""
+    land: Dict[Tuple[int, int], bool] = collections.defaultdict(bool)
+    for (y, x), value in np.ndenumerate(caves.land):
+        land[(x, y)] = bool(value)
+    return land
+
+
+def legacy_caves(land: Dict[Tuple[int, int], bool], width: int, height: int) -> Image:
+    """the original FractalCaves.render loop, counting the neighbours of
+    each point in the dict and drawing it with one draw.point"""
+    img = NewImage("RGB", (width, height))
+    draw = ImageDraw.Draw(img)
+    for x, y in list(land.keys()):
+        pc = 0
+        for xo in range(x - 1, x + 2):
+            xx = xo % width
+            for yo in range(y - 1, y + 2):
+                yy = yo % height
+                if land[(xx, yy)]:
+                    pc = pc + 1
+        g = 32 * pc - 1
+        b = 255 - g
+        draw.point([(x, y)], (0, g, b))
+    return img
+
+
+def timed(func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(1)
+    print(f"{'':>7} {'size':>5} {'legacy s':>9} {'array s':>9} {'speedup':>8} identical")
+    for size in args.sizes:
+        heights = FractalMap.normalise(FractalMap(size).generate(3))[:, :-1, :-1]
+        t_old, old = timed(lambda: legacy_plasma(heights), args.repeat)
+        t_new, new = timed(lambda: array_image(heights), args.repeat)
+        same = old.tobytes() == new.tobytes()
+        print(f"{'plasma':>7} {size:>5} {t_old:>9.4f} {t_new:>9.4f} {t_old / t_new:>7.1f}x {same}")
+
+        caves = FractalCaves(size // 4, iterations=2).generate().double()
+        caves.smooth(1).double().smooth(1)
+        land = legacy_land(caves)
+        t_old, old = timed(lambda: legacy_caves(land, caves.x, caves.y), args.repeat)
+        t_new, new = timed(caves.render, args.repeat)
+        same = old.tobytes() == new.tobytes()
+        print(f"{'caves':>7} {size:>5} {t_old:>9.4f} {t_new:>9.4f} {t_old / t_new:>7.1f}x {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""frames per second and file size of MazeMaker.animate()
+
+    python benchmarks/maze_animation.py [--sizes 32 64] [--cell 16]
+"""
+
+import time
+from argparse import ArgumentParser
+
+from hashamatic.command.maze import MazeMaker
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--cell", type=int, default=16)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0, 200])
+    args = parser.parse_args()
+
+    colour = (200, 200, 200)
+    print(f"{'size':>7} {'frames':>7} {'every':>6} {'seconds':>8} {'fps':>8} {'KiB':>8}")
+    for size in args.sizes:
+        maker = MazeMaker(size, size)
+        maker.history = []
+        maker.generate()
+        steps = len(maker.history)
+        for budget in args.budgets:
+            # a budget of 0 animates every step
+            every = max(1, -(-steps // budget)) if budget else 1
+            start = time.perf_counter()
+            data = maker.replay(args.cell, 1, every, 40, colour)
+            seconds = time.perf_counter() - start
+            frames = steps // every + 2
+            print(
+                f"{size:>3}x{size:<3} {frames:>7} {every:>6} {seconds:>8.3f} "
+                f"{frames / seconds:>8.0f} {len(data) / 1024:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
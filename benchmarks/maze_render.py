@@ -0,0 +1,172 @@
+"""compare the template rasterizer in MazeMaker against per-cell drawing
+
+    python benchmarks/maze_render.py [--size COLS ROWS] [--cells 4 8 16 60] [--repeat N]
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+from PIL import ImageDraw
+from PIL.Image import Image
+from PIL.Image import new as NewImage
+
+from hashamatic.command.maze import LEFT, RIGHT, TOP, BOTTOM, SOLID, MazeMaker
+
+
+def legacy_render(self: MazeMaker, cell_size: int = 16, border: int = 1) -> Image:
+    """the original per-cell ImageDraw.rectangle renderer"""
+    img = NewImage("RGB", (self.width * cell_size, self.height * cell_size))
+    draw = ImageDraw.Draw(img)
+
+    floor_color = "rgb(%d,%d,%d)" % (
+        random.choice(range(128, 256)),
+        random.choice(range(128, 256)),
+        random.choice(range(128, 256)),
+    )
+    for xos in range(0, self.width):
+        for yos in range(0, self.height):
+            cell = self.get_cell(xos + 1, yos + 1)
+            xcs = xos * cell_size
+            ycs = yos * cell_size
+            if not cell & SOLID:
+                draw.rectangle(
+                    (
+                        (xcs + border, ycs + border),
+                        (
+                            xcs + cell_size - border - 1,
+                            ycs + cell_size - border - 1,
+                        ),
+                    ),
+                    floor_color,
+                )
+            if not cell & LEFT:
+                draw.rectangle(
+                    (
+                        (xcs, ycs + border),
+                        (xcs + border, ycs + cell_size - border - 1),
+                    ),
+                    floor_color,
+                )
+            if not cell & RIGHT:
+                draw.rectangle(
+                    (
+                        (xcs + cell_size - border - 1, ycs + border),
+                        (xcs + cell_size - 1, ycs + cell_size - border - 1),
+                    ),
+                    floor_color,
+                )
+            if not cell & TOP:
+                draw.rectangle(
+                    (
+                        (xcs + border, ycs),
+                        (xcs + cell_size - border - 1, ycs + border),
+                    ),
+                    floor_color,
+                )
+            if not cell & BOTTOM:
+                draw.rectangle(
+                    (
+                        (xcs + border, ycs + cell_size - border - 1),
+                        (xcs + cell_size - border - 1, ycs + cell_size - 1),
+                    ),
+                    floor_color,
+                )
+    draw.regular_polygon(
+        (cell_size / 2, cell_size / 2, cell_size / 2),
+        n_sides=5,
+        fill="rgb(0,192,0)",
+        rotation=-90,
+    )
+    draw.regular_polygon(
+        (
+            self.width * cell_size - cell_size / 2,
+            self.height * cell_size - cell_size / 2,
+            cell_size / 2,
+        ),
+        n_sides=5,
+        fill="rgb(192,0,0)",
+        rotation=90,
+    )
+
+    return img
+
+
+def legacy_render_as_mask(self: MazeMaker, cell_size: int = 16) -> Image:
+    """the original per-cell ImageDraw.rectangle mask renderer"""
+    mask = NewImage("1", (self.width * cell_size, self.height * cell_size))
+    draw = ImageDraw.Draw(mask)
+
+    for xos in range(0, self.width):
+        for yos in range(0, self.height):
+            cell = self.get_cell(xos + 1, yos + 1)
+            xcs = xos * cell_size
+            ycs = yos * cell_size
+            draw.rectangle(
+                ((xcs + 1, ycs + 1), (xcs + cell_size - 2, ycs + cell_size - 2)),
+                True,
+            )
+            if not cell & LEFT:
+                draw.rectangle(
+                    ((xcs, ycs + 1), (xcs + 1, ycs + cell_size - 2)), True
+                )
+            if not cell & RIGHT:
+                draw.rectangle(
+                    (
+                        (xcs + cell_size - 2, ycs + 1),
+                        (xcs + cell_size - 1, ycs + cell_size - 2),
+                    ),
+                    True,
+                )
+            if not cell & TOP:
+                draw.rectangle(
+                    ((xcs + 1, ycs), (xcs + cell_size - 2, ycs + 1)), True
+                )
+            if not cell & BOTTOM:
+                draw.rectangle(
+                    (
+                        (xcs + 1, ycs + cell_size - 2),
+                        (xcs + cell_size - 2, ycs + cell_size - 1),
+                    ),
+                    True,
+                )
+
+    return mask
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--size", type=int, nargs=2, default=[40, 18])
+    parser.add_argument("--cells", type=int, nargs="+", default=[4, 8, 16, 32, 60])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    maker = MazeMaker(*args.size).generate()
+    for cell_size in args.cells:
+        # the templates are built once per process, don't time that
+        maker.render(cell_size, 3 if cell_size >= 32 else 1)
+        maker.render_as_mask(cell_size)
+    print(f"{args.size[0]}x{args.size[1]} maze")
+    print(f"{'cell':>5} {'legacy s':>9} {'raster s':>9} {'speedup':>8} identical")
+    for cell_size in args.cells:
+        border = 3 if cell_size >= 32 else 1
+        t_old = t_new = float("inf")
+        for _ in range(args.repeat):
+            state = random.getstate()
+            start = time.perf_counter()
+            old = legacy_render(maker, cell_size, border)
+            old_mask = legacy_render_as_mask(maker, cell_size)
+            t_old = min(t_old, time.perf_counter() - start)
+
+            random.setstate(state)
+            start = time.perf_counter()
+            new = maker.render(cell_size, border)
+            new_mask = maker.render_as_mask(cell_size)
+            t_new = min(t_new, time.perf_counter() - start)
+
+        same = old.tobytes() == new.tobytes() and old_mask.tobytes() == new_mask.tobytes()
+        print(f"{cell_size:>5} {t_old:>9.4f} {t_new:>9.4f} {t_old / t_new:>7.1f}x {same}")
+
+
+if __name__ == "__main__":
+    main()
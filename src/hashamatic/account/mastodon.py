@@ -1,6 +1,5 @@
 ''' Mastodon Accounts for hashamatic '''
 
-import io
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 import re
@@ -87,10 +86,8 @@ class _Mastodon(BotAccount, iPost, iMessage):
 
             media_ids = None
 
-            if node.image:
-                image_io = io.BytesIO()
-                node.image.save(image_io, format="PNG")
-                imagedata = image_io.getvalue()
+            if node.image or node.animation:
+                imagedata = node.png_data()
                 media_ids = self.client.media_post(
                     imagedata,
                     mime_type="image/png",
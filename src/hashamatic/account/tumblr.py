@@ -42,10 +42,8 @@ class Tumblr(BotAccount, iPost):
         media: Optional[dict] = None
         (tfhandle, tfname) = tempfile.mkstemp()
 
-        if post.image:
-            image_io = io.BytesIO()
-            post.image.save(image_io, format="PNG")
-            imagedata = image_io.getvalue()
+        if post.image or post.animation:
+            imagedata = post.png_data()
             tfio = os.fdopen(tfhandle, "wb")
             tfio.write(imagedata)
             tfio.close()
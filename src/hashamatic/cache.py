@@ -0,0 +1,11 @@
+"""where hashamatic keeps files it can rebuild, such as compiled word
+lists, solved puzzles and plasma tiles"""
+
+import os
+from pathlib import Path
+
+
+def cache_dir() -> Path:
+    """the per-user cache directory, $XDG_CACHE_HOME/hashamatic"""
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "hashamatic"
@@ -4,6 +4,7 @@ from __future__ import annotations
 import argparse
 import glob
 import importlib
+import io
 import logging
 import os
 import random
@@ -15,16 +16,19 @@ from PIL.Image import Image
 
 class BotResult():
     ''' holds the result of a command
-        (image, alt_text, text and tags)'''
+        (image, alt_text, text and tags)
+        animation is optional animated PNG data to post in place of image '''
     def __init__(
         self,
         image: Optional[Image] = None,
         text: str = "",
         tags: Optional[List[str]] = None,
         alt_text: Optional[str] = None,
-        warning: Optional[str] = None
+        warning: Optional[str] = None,
+        animation: Optional[bytes] = None
     ) -> None:
         self.image = image
+        self.animation = animation
         self.text = str(text)
         self.alt_text = alt_text
         self.warning = warning
@@ -36,6 +40,8 @@ class BotResult():
 
     def __str__(self) -> str:
         ret = ""
+        if self.animation:
+            ret += f" Has Animation ({len(self.animation)} bytes)\n"
         if self.image:
             ret += f" Has Image ({self.alt_text})\n"
         ret += f" Text: {self.text}\n"
@@ -43,6 +49,15 @@ class BotResult():
             ret += f" Tags: {' '.join(sorted(self.tags))}\n"
         return ret.strip()
 
+    def png_data(self) -> bytes:
+        ''' the animation, or the image encoded as a PNG '''
+        if self.animation:
+            return self.animation
+        image_io = io.BytesIO()
+        if self.image:
+            self.image.save(image_io, format="PNG")
+        return image_io.getvalue()
+
     def append(self, child: BotResult):
         ''' append a BotResult to the end of the list '''
         node = self
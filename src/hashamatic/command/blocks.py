@@ -4,8 +4,9 @@ import collections
 import logging
 import random
 from argparse import ArgumentParser, Namespace
-from typing import Dict, List, Tuple, Set
+from typing import Dict, Iterator, List, Set, Tuple
 
+import numpy as np
 from PIL import ImageDraw
 from PIL.Image import Image
 from PIL.Image import new as NewImage
@@ -32,6 +33,15 @@ try:
             parser.add_argument(
                 "--fill_ratio", type=int, choices=range(1, 10), default=1
             )
+            parser.add_argument(
+                "--distribution",
+                choices=["classic", "power"],
+                default=None,
+                help="pack squares along a skyline, for canvases thousands of cells across",
+            )
+            parser.add_argument(
+                "--block_size", type=int, default=None, help="pixels per cell"
+            )
             return parser
 
         def run(self, args: Namespace) -> BotResult:
@@ -42,18 +52,25 @@ try:
                 rows = random.randint(12, 32)
             else:
                 rows = max(rows, 1)
-                rows = min(rows, 65)
             if not cols:
                 cols = rows
             else:
                 cols = max(cols, 1)
-                cols = min(cols, 65)
 
-            b = BlocksMaker(rows, cols, fill_prob=args.fill_ratio)
+            # shrink the blocks to keep the image no bigger than a 65x65 grid's,
+            # but never below 2 pixels, so grids over 2600 cells across grow past it
+            block_size = args.block_size or max(2, min(80, 5200 // max(rows, cols)))
+            b = BlocksMaker(
+                rows, cols, block_size, max(1, block_size // 20), args.fill_ratio
+            )
             alt_text = [
                 f"A computer generated picture of multicoloured squares of various sizes packed into a {cols} by {rows} grid"
             ]
-            raw_image = b.generate().render(args.renderer)
+            if args.distribution:
+                b.pack(args.distribution)
+            else:
+                b.generate()
+            raw_image = b.render(args.renderer)
 
             return BotResult(raw_image, tags=self.tags, alt_text=" ".join(alt_text))
 
@@ -84,13 +101,43 @@ except ImportError:
 #             1 in probi chance of growing by 1
 
 
+class Skyline:
+    """free space in a grid filled row by row: everything above the current
+    row is full, so each column is full down to its height and empty below"""
+
+    def __init__(self, rows: int, columns: int):
+        self.rows = rows
+        self.heights = np.zeros(columns, dtype=np.int64)
+
+    def gaps(self) -> Iterator[Tuple[int, int, int]]:
+        """(row, start, end) for each run of free columns, from the lowest
+        row with a free cell; squares must be placed in a run before
+        moving on to the next"""
+        while True:
+            r = int(self.heights.min())
+            if r >= self.rows:
+                return
+            free = np.flatnonzero(self.heights == r)
+            breaks = np.flatnonzero(np.diff(free) > 1) + 1
+            for run in np.split(free, breaks):
+                yield r, int(run[0]), int(run[-1]) + 1
+
+    def place(self, row: int, column: int, size: int):
+        """fill a size x size square with its top left corner here"""
+        self.heights[column : column + size] = row + size
+
+
 class BlocksMaker:
-    """generate packings of random sized and coloured blocks"""
+    """generate packings of random sized and coloured blocks
+
+    squares holds each placed block as (row, column, size), in the order
+    their top left corners are reached; grid holds 1 + the index into
+    squares of the block covering each cell, or 0 if it is empty"""
 
-    map: Dict[int, Dict[int, str | None]] = collections.defaultdict(dict)
     # maxs = 5  # max square size
     probs = 7  # 1:x chance of seed square entering growth
     probi = 2  # 1:x chance of growing each pass of growth iteration
+    alpha = 1.5  # shape of the power distribution, lower gives bigger squares
 
     def __init__(
         self,
@@ -106,29 +153,65 @@ class BlocksMaker:
         self.block_size = block_size
         self.border_width = border_width
         self.probf = fill_prob
+        self.grid = np.zeros((rows, columns), dtype=np.int32)
+        self.squares: List[Tuple[int, int, int]] = []
 
     def generate(self):
         """generate the cells"""
 
-        self.map = collections.defaultdict(dict)
-        for r in range(-1, 1 + self.rows):
-            for c in range(-1, 1 + self.columns):
-                self.map[r][c] = None
+        self.grid[:] = 0
+        self.squares = []
+        grid = self.grid
         for r in range(self.rows):
             for c in range(self.columns):
-                if self.map[r][c]:
+                if grid[r, c]:
                     continue
                 s = 1
                 if not random.choice(range(self.probs)):
                     for _ in range(1, self.maxs):
                         if (c + s) < self.columns and (r + s) < self.rows:
-                            if self.map[r + s + 1][c] or self.map[r][c + s + 1]:
+                            # the new column and row the square would grow into
+                            if grid[r : r + s + 1, c + s].any() or grid[r + s, c : c + s].any():
                                 continue
                             if not random.choice(range(self.probi)):
                                 s = s + 1
-                for x in range(s):
-                    for y in range(s):
-                        self.map[r + y][c + x] = f"{s}:{r}:{c}"
+                self.squares.append((r, c, s))
+                grid[r : r + s, c : c + s] = len(self.squares)
+        return self
+
+    def size(self, distribution: str, fit: int) -> int:
+        """pick the size of a square that has room to be up to fit cells"""
+        if distribution == "power":
+            # maxs is 0 for grids under 4 cells across, but a square is at least 1
+            return max(1, min(fit, self.maxs, int(random.paretovariate(self.alpha))))
+        # as generate() grows them, stopping once the square runs out of room
+        s = 1
+        if not random.choice(range(self.probs)):
+            for _ in range(1, self.maxs):
+                if s >= fit:
+                    break
+                if not random.choice(range(self.probi)):
+                    s = s + 1
+        return s
+
+    def pack(self, distribution: str = "classic"):
+        """generate the cells along a skyline, in the same order as
+        generate() but jumping straight to the free cells, which stays
+        fast for canvases thousands of cells across"""
+
+        self.grid[:] = 0
+        self.squares = []
+        skyline = Skyline(self.rows, self.columns)
+        for r, start, end in skyline.gaps():
+            c = start
+            while c < end:
+                s = self.size(distribution, min(end - c, self.rows - r))
+                if s < 1:
+                    raise ValueError(f"square of size {s} at {r}, {c}")
+                skyline.place(r, c, s)
+                self.squares.append((r, c, s))
+                self.grid[r : r + s, c : c + s] = len(self.squares)
+                c += s
         return self
 
     def render(self, renderer: str = "PlainTile") -> Image:
@@ -142,52 +225,37 @@ class BlocksMaker:
         else:
             tile_renderer = TileRenderer.renderers[TileRenderer.get_default()]
 
-        for r in range(self.rows):
-            for c in range(self.columns):
-                if f":{r}:{c}" in self.map[r][c]:
-                    if not random.choice(range(self.probf)):
-                        s = int(self.map[r][c][0])
-                        tile = tile_renderer.render(s * bs, bw)
-                        img.paste(tile, (c * bs, r * bs))
+        for r, c, s in self.squares:
+            if not random.choice(range(self.probf)):
+                tile = tile_renderer.render(s * bs, bw)
+                img.paste(tile, (c * bs, r * bs))
         return img
 
     def render5colour(self, colours: List[str]) -> Image:
         """render the cells as an image using only 5 colours"""
 
         pivotmap: Dict[int, List[Tuple[int, int]]] = collections.defaultdict(list)
-        colormap: Dict[Tuple[int, int], int] = {}
-
-        # empty colour map
-        for r in range(-1, self.rows + 1):
-            for c in range(-1, self.columns + 1):
-                colormap[(r, c)] = 0
+        # empty colour map, with a border of 0 so edges need no special case
+        colormap = np.zeros((self.rows + 2, self.columns + 2), dtype=np.int32)
 
         # build up lists of squares by size
-        for r in range(self.rows):
-            for c in range(self.columns):
-                if f":{r}:{c}" in self.map[r][c]:
-                    s = int(self.map[r][c][0])
-                    pivotmap[s].append((r, c))
+        for r, c, s in self.squares:
+            pivotmap[s].append((r, c))
 
         # work out colours
         colorrange = set(range(1, len(colours) + 1))
         for s in sorted(pivotmap.keys(), reverse=True):
             for r, c in pivotmap[s]:
                 seen: Set[int] = set()
-                for rr in range(r, r + s):
-                    seen.add(colormap[(rr, c - 1)])
-                    seen.add(colormap[(rr, c + s)])
-                for cc in range(c, c + s):
-                    seen.add(colormap[(r - 1, cc)])
-                    seen.add(colormap[(r + s, cc)])
+                seen.update(colormap[r + 1 : r + s + 1, c].tolist())
+                seen.update(colormap[r + 1 : r + s + 1, c + s + 1].tolist())
+                seen.update(colormap[r, c + 1 : c + s + 1].tolist())
+                seen.update(colormap[r + s + 1, c + 1 : c + s + 1].tolist())
                 choices = list(colorrange - seen)
                 if not choices:
                     raise ValueError("Something went wrong, no colours left")
                 color = random.choice(choices)
-                # print(seen, choices, color)
-                for rr in range(r, r + s):
-                    for cc in range(c, c + s):
-                        colormap[(rr, cc)] = color
+                colormap[r + 1 : r + s + 1, c + 1 : c + s + 1] = color
 
         bs = self.block_size
         bw = self.border_width
@@ -201,7 +269,7 @@ class BlocksMaker:
                         (c * bs + bw, r * bs + bw),
                         ((c + s) * bs - bw, (r + s) * bs - bw),
                     ),
-                    colours[colormap[(r, c)] - 1],
+                    colours[colormap[r + 1, c + 1] - 1],
                 )
         return img
 
@@ -212,17 +280,14 @@ class BlocksMaker:
         bw = self.border_width
         mask = NewImage("1", (bs * self.columns, bs * self.rows))
         draw = ImageDraw.Draw(mask)
-        for r in range(self.rows):
-            for c in range(self.columns):
-                if f":{r}:{c}" in self.map[r][c]:
-                    s = int(self.map[r][c][0])
-                    draw.rectangle(
-                        (
-                            (c * bs + bw, r * bs + bw),
-                            ((c + s) * bs - bw, (r + s) * bs - bw),
-                        ),
-                        True,
-                    )
+        for r, c, s in self.squares:
+            draw.rectangle(
+                (
+                    (c * bs + bw, r * bs + bw),
+                    ((c + s) * bs - bw, (r + s) * bs - bw),
+                ),
+                True,
+            )
         return mask
 
 
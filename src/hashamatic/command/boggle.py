@@ -5,16 +5,27 @@
 
 # Possible wordlist: https://norvig.com/ngrams/count_1w.txt
 
+import collections
+import json
 import logging
-from argparse import ArgumentParser, Namespace
-from typing import List, Optional, Set, Dict, Tuple
-
-from random import shuffle, choice, randint
+import sqlite3
+import string
+import sys
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from random import shuffle, choice, choices, randint
 import importlib.resources
 
 import PIL.Image
 import PIL.ImageDraw
-import PIL.ImageFont
+
+from hashamatic.cache import cache_dir
+from hashamatic.lexicon import get_lexicon
+
+from .imaging import load_font
 
 
 class FixedWidth:
@@ -39,6 +50,17 @@ def grouper(n: int, s: str) -> list[str]:
     return [s[0 + i : n + i] for i in range(0, len(s), n)]
 
 
+def grid_size(text: str) -> Tuple[int, int]:
+    """parse a WIDTHxHEIGHT grid size"""
+    try:
+        width, height = [int(x) for x in text.lower().split("x")]
+    except ValueError as e:
+        raise ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text}") from e
+    if width < 1 or height < 1:
+        raise ArgumentTypeError(f"grid size must be positive, got {text}")
+    return width, height
+
+
 try:
     from hashamatic.command import BotCmd, BotResult
 
@@ -51,17 +73,34 @@ try:
         def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
             parser.add_argument("--solve", nargs="+", type=str)
             parser.add_argument("--game", choices=dicesets.keys())
+            parser.add_argument("--size", type=grid_size, default=None)
             parser.add_argument("--minlen", type=int, default=3)
+            parser.add_argument("--minwords", type=int, default=0)
+            parser.add_argument("--minlongest", type=int, default=0)
+            parser.add_argument("--bank", type=Path, default=None)
             return parser
 
         def run(self, args: Namespace) -> BotResult:
-            if args.game:
-                game = Boggle(dice=args.game)
-            elif args.solve:
+            if args.solve and not args.game:
                 game = Boggle(force=[x.upper() for x in args.solve])
+                words = game.solve(args.minlen)
+            elif args.size:
+                game = Boggle(dice=args.game or "standard", size=args.size)
+                words = game.solve(args.minlen)
             else:
-                game = Boggle()
-            words = game.solve(args.minlen)
+                dice = args.game or "standard"
+                banked = PuzzleBank(args.bank).pop(
+                    dice, args.minlen, args.minwords, args.minlongest
+                )
+                if banked:
+                    game, words = banked
+                else:
+                    logging.info("no suitable %s board in the bank, solving", dice)
+                    for _ in range(PuzzleBank.attempts):
+                        game = Boggle(dice=dice)
+                        words = game.solve(args.minlen)
+                        if PuzzleBank.suitable(words, args.minwords, args.minlongest):
+                            break
             post = BotResult(
                 image=game.render(),
                 alt_text=" ".join(
@@ -98,6 +137,25 @@ try:
             args = parser.parse_args("".split())
             return self.run(args)
 
+    class GriddleBank(BotCmd):
+        """pre-solves griddle boards into the local puzzle bank"""
+
+        @staticmethod
+        def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
+            parser.add_argument("count", type=int, nargs="?", default=100)
+            parser.add_argument("--game", choices=dicesets.keys(), default="standard")
+            parser.add_argument("--minlen", type=int, default=3)
+            parser.add_argument("--workers", type=int, default=None)
+            parser.add_argument("--bank", type=Path, default=None)
+            return parser
+
+        def run(self, args: Namespace) -> BotResult:
+            bank = PuzzleBank(args.bank)
+            bank.fill(args.game, args.minlen, args.count, args.workers)
+            return BotResult(
+                text=f"Bank holds {bank.size(args.game, args.minlen)} {args.game} boards."
+            )
+
 except ImportError:
     logging.debug("failed to import BotCmd interface")
 
@@ -139,24 +197,76 @@ dicesets["super"][2].extend(
         "HLNNRZ",
     ]
 )
+# Super Big Boggle style, with digraph and blank faces replaced by single letters
+dicesets["big"] = (
+    6,
+    6,
+    [
+        "AAAFRS",
+        "AAEEEE",
+        "AAEEOO",
+        "AAFIRS",
+        "ABDEIO",
+        "ADENNN",
+        "AEEEEM",
+        "AEEGMU",
+        "AEGMNN",
+        "AEHIQT",
+        "AEILMN",
+        "AEINOU",
+        "AFIRSY",
+        "BBJKXZ",
+        "CCENST",
+        "CDDLNN",
+        "CEIITT",
+        "CEIPST",
+        "CFGNUY",
+        "DDHNOT",
+        "DHHLOR",
+        "DHHNOW",
+        "DHLNOR",
+        "EHILRS",
+        "EIILST",
+        "EILPST",
+        "EIOEIO",
+        "EMTTTO",
+        "ENSSSU",
+        "GORRVW",
+        "HIRSTV",
+        "HOPRST",
+        "IPRSYY",
+        "JKQWXZ",
+        "NOOTUW",
+        "OOOTTU",
+    ],
+)
 
 
 class Boggle:
     """generate boggle boards"""
 
     font: Optional[PIL.Image.Image] = None
+    # per style, each letter's tile in the four rotations
+    glyphs: Dict[str, Dict[str, List[PIL.Image.Image]]] = {"modern": {}, "retro": {}}
     grid: List[str]
 
-    def __init__(self, dice: str = "standard", force: Optional[List[str]] = None):
+    def __init__(
+        self,
+        dice: str = "standard",
+        force: Optional[List[str]] = None,
+        size: Optional[Tuple[int, int]] = None,
+    ):
         if force:
+            if len({len(x) for x in force}) != 1:
+                raise ValueError("all rows of the grid must be the same length")
             self.grid = force
             self.width = len(force[0])
             self.height = len(force)
         else:
             self.width, self.height, self.dice = dicesets[dice]
+            if size:
+                self.width, self.height = size
             self.shuffle()
-        if not self.font:
-            self.font = self.loadfont()
 
     @staticmethod
     def loadfont() -> PIL.Image.Image:
@@ -176,42 +286,63 @@ class Boggle:
         )
 
     def shuffle(self) -> None:
-        """shuffle the dice"""
+        """shuffle the dice, rolling extra copies if the grid needs more"""
         shuffle(self.dice)
+        cells = self.width * self.height
+        dice = self.dice[:cells]
+        if len(dice) < cells:
+            dice += choices(self.dice, k=cells - len(dice))
         faces: list[str] = []
-        for die in self.dice:
+        for die in dice:
             faces.append(choice(die))
         self.grid = ["".join(x) for x in grouper(self.width, "".join(faces))]
 
+    @classmethod
+    def glyph(cls, style: str, letter: str) -> List[PIL.Image.Image]:
+        """returns the four rotations of a letter tile,
+        rendering the whole alphabet the first time a style is used"""
+        atlas = cls.glyphs[style]
+        if not atlas:
+            for ch in string.ascii_uppercase:
+                atlas[ch] = cls.render_glyph(style, ch)
+        if letter not in atlas:
+            atlas[letter] = cls.render_glyph(style, letter)
+        return atlas[letter]
+
+    @classmethod
+    def render_glyph(cls, style: str, letter: str) -> List[PIL.Image.Image]:
+        """render a single letter tile in each rotation"""
+        if style == "retro":
+            if not cls.font:
+                cls.font = cls.loadfont()
+            index = ord(letter) - ord("A")
+            letter_img = cls.font.crop((16 * index, 0, 16 * index + 18, 18))
+        else:
+            letter_img = PIL.Image.new("RGB", (72, 72))
+            draw = PIL.ImageDraw.Draw(letter_img)
+            if letter == "Q":
+                letter = "Qu"
+            font = load_font("DejaVuSansMono", 54)
+            draw.text((36, 36), letter, anchor="mm", fill="lightgrey", font=font)
+        return [letter_img.rotate(90 * x) for x in range(4)]
+
     def render_retro(self) -> PIL.Image.Image:
         """render the current grid as an image"""
         img = PIL.Image.new("RGB", (24 * self.width, 24 * self.height), "orange")
-        if not self.font:
-            self.font = self.loadfont()
-
         for row in range(self.height):
             for col in range(self.width):
-                letter = ord(self.grid[row][col]) - ord("A")
-                letter_img = self.font.crop((16 * letter, 0, 16 * letter + 18, 18))
-                letter_img = letter_img.rotate(90 * randint(0, 4))
-                img.paste(letter_img, (6 + col * 22, 6 + row * 22))
+                letter_img = self.glyph("retro", self.grid[row][col])
+                img.paste(letter_img[randint(0, 4) % 4], (6 + col * 22, 6 + row * 22))
         return img.resize((96 * self.width, 96 * self.height), resample=0)
 
     def render(self) -> PIL.Image.Image:
         """render the current grid as an image"""
         img = PIL.Image.new("RGB", (96 * self.width, 96 * self.height), "#406060")
-        font = PIL.ImageFont.truetype("DejaVuSansMono", 54)
         for row in range(self.height):
             for col in range(self.width):
-                letter_img = PIL.Image.new("RGB", (72, 72))
-                draw = PIL.ImageDraw.Draw(letter_img)
-                letter = self.grid[row][col]
-                if letter == "Q":
-                    letter = "Qu"
-                draw.text((36, 36), letter, anchor="mm", fill="lightgrey", font=font)  # type: ignore
+                letter_img = self.glyph("modern", self.grid[row][col])
                 # rotate letter, bias to right way up.
-                letter_img = letter_img.rotate(90 * randint(0, 5))
-                img.paste(letter_img, (24 + col * 88, 24 + row * 88))
+                img.paste(letter_img[randint(0, 5) % 4], (24 + col * 88, 24 + row * 88))
         return img
 
     @staticmethod
@@ -252,24 +383,212 @@ class Boggle:
         board[i][j] = ch
         return ans
 
+    def neighbours(self) -> List[List[int]]:
+        """list of adjacent cell indexes for each cell of the grid"""
+        ret: List[List[int]] = []
+        for row in range(self.height):
+            for col in range(self.width):
+                ret.append(
+                    [
+                        r * self.width + c
+                        for r in range(max(row - 1, 0), min(row + 2, self.height))
+                        for c in range(max(col - 1, 0), min(col + 2, self.width))
+                        if (r, c) != (row, col)
+                    ]
+                )
+        return ret
+
     def solve(self, minlen: int) -> Set[str]:
-        """solves the current grid"""
+        """solves the current grid by walking the board through the lexicon"""
         ret: set[str] = set()
-        with importlib.resources.path("hashamatic.resources", "words.txt") as wordlist:
-            st = {
-                x.strip().upper()
-                for x in wordlist.read_text(encoding="utf8").splitlines()
-                if len(x) >= minlen
-            }
-
-        board = [list(x) for x in self.grid]
-        for word in st:
-            if self.exist(board, word):
-                ret.add(word)
+        lexicon = get_lexicon()
+        cells = "".join(self.grid)
+        adjacent = self.neighbours()
+        used = [False] * len(cells)
+        word: List[str] = []
+
+        def walk(pos: int, node: int, bare_q: bool) -> None:
+            # a Q die is QU, but still matches a Q that isn't followed by U
+            ch = cells[pos]
+            if bare_q and ch == "U":
+                return
+            node = lexicon.child(node, ch)
+            if node < 0:
+                return
+            used[pos] = True
+            word.append(ch)
+            visit(pos, node, ch == "Q")
+            if ch == "Q":
+                node = lexicon.child(node, "U")
+                if node >= 0:
+                    word.append("U")
+                    visit(pos, node, False)
+                    word.pop()
+            word.pop()
+            used[pos] = False
+
+        def visit(pos: int, node: int, bare_q: bool) -> None:
+            if len(word) >= minlen and lexicon.is_word(node):
+                ret.add("".join(word))
+            for nxt in adjacent[pos]:
+                if not used[nxt]:
+                    walk(nxt, node, bare_q)
+
+        for pos in range(len(cells)):
+            walk(pos, lexicon.root, False)
 
         return ret
 
 
+def solve_board(dice: str, minlen: int) -> Tuple[str, List[str]]:
+    """generate and solve one board, for use by pool workers"""
+    game = Boggle(dice=dice)
+    return " ".join(game.grid), sorted(game.solve(minlen))
+
+
+class PuzzleBank:
+    """sqlite store of pre-solved boards, so posting doesn't wait on a solve"""
+
+    attempts = 20  # boards to try when the bank can't meet the target
+    schema = """
+        CREATE TABLE IF NOT EXISTS boards (
+            id INTEGER PRIMARY KEY,
+            dice TEXT NOT NULL,
+            minlen INTEGER NOT NULL,
+            grid TEXT NOT NULL,
+            words TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            longest INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS boards_count ON boards (dice, minlen, count);
+        CREATE INDEX IF NOT EXISTS boards_longest ON boards (dice, minlen, longest);
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or cache_dir() / "griddle.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.db.executescript(self.schema)
+
+    @staticmethod
+    def suitable(words: Set[str], minwords: int, minlongest: int) -> bool:
+        """true if the solution meets the word count and longest word targets"""
+        return (
+            len(words) >= minwords
+            and max([len(x) for x in words], default=0) >= minlongest
+        )
+
+    def add(self, dice: str, minlen: int, boards: Iterable[Tuple[str, List[str]]]):
+        """store solved boards"""
+        self.db.executemany(
+            "INSERT INTO boards (dice, minlen, grid, words, count, longest)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    dice, minlen, grid, " ".join(words),
+                    len(words), max([len(x) for x in words], default=0),
+                )
+                for grid, words in boards
+            ],
+        )
+
+    def fill(self, dice: str, minlen: int, count: int, workers: Optional[int] = None):
+        """generate and solve count boards across a process pool"""
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            solved = pool.map(
+                solve_board, [dice] * count, [minlen] * count,
+                chunksize=max(1, count // 64),
+            )
+            batch: List[Tuple[str, List[str]]] = []
+            for board in solved:
+                batch.append(board)
+                if len(batch) >= 100:
+                    self.add(dice, minlen, batch)
+                    batch = []
+            self.add(dice, minlen, batch)
+
+    def pop(
+        self, dice: str, minlen: int, minwords: int = 0, minlongest: int = 0
+    ) -> Optional[Tuple[Boggle, Set[str]]]:
+        """remove and return a suitable board and its solution"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT id, grid, words FROM boards"
+                " WHERE dice = ? AND minlen = ? AND count >= ? AND longest >= ?"
+                " LIMIT 1",
+                (dice, minlen, minwords, minlongest),
+            ).fetchone()
+            if row:
+                self.db.execute("DELETE FROM boards WHERE id = ?", (row[0],))
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.execute("ROLLBACK")
+            raise
+        if not row:
+            return None
+        return Boggle(force=row[1].split()), set(row[2].split())
+
+    def size(self, dice: str, minlen: int) -> int:
+        """number of banked boards"""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM boards WHERE dice = ? AND minlen = ?",
+            (dice, minlen),
+        ).fetchone()[0]
+
+
+def solve_grid(board: str, minlen: int) -> Dict[str, Any]:
+    """solve one board given as space or / separated rows, for use by pool workers"""
+    rows = board.upper().replace("/", " ").split()
+    try:
+        words = sorted(Boggle(force=rows).solve(minlen))
+    except (ValueError, IndexError) as e:
+        return {"board": rows, "error": str(e)}
+    return {
+        "board": rows,
+        "words": words,
+        "count": len(words),
+        "longest": max([len(x) for x in words], default=0),
+    }
+
+
+def solve_batch(
+    boards: Iterable[str], minlen: int = 3, workers: Optional[int] = None,
+    inflight: int = 64,
+) -> Iterator[Dict[str, Any]]:
+    """solve boards across a process pool, yielding results in input order
+    with at most inflight boards queued at once"""
+    pending: collections.deque = collections.deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=get_lexicon) as pool:
+        for board in boards:
+            if not board.strip() or board.startswith("#"):
+                continue
+            pending.append(pool.submit(solve_grid, board, minlen))
+            if len(pending) >= inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batch_main():
+    """solve boards from files or stdin, one per line, writing JSON lines"""
+    parser = ArgumentParser(description=batch_main.__doc__)
+    parser.add_argument("files", nargs="*", default=["-"])
+    parser.add_argument("--minlen", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--inflight", type=int, default=64)
+    args = parser.parse_args()
+
+    def lines() -> Iterator[str]:
+        for name in args.files:
+            fp: TextIO = sys.stdin if name == "-" else open(name, encoding="utf8")
+            with fp:
+                yield from fp
+
+    for result in solve_batch(lines(), args.minlen, args.workers, args.inflight):
+        sys.stdout.write(json.dumps(result) + "\n")
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, force=True)
     ggame = Boggle()
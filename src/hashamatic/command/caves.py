@@ -2,15 +2,18 @@
 
 from __future__ import annotations
 
-import collections
+import functools
 import logging
 import random
 from argparse import ArgumentParser, Namespace
-from typing import Dict, List, Tuple, Optional
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
 
-from PIL import ImageDraw
+import numpy as np
 from PIL.Image import Image
-from PIL.Image import new as NewImage
+from PIL.Image import open as open_image
+
+from .imaging import ApngWriter, PngWriter, array_image
 
 try:
     from hashamatic.command import BotCmd, BotResult, iRandom
@@ -19,19 +22,96 @@ try:
         ''' a bad implmentation of a fractal map '''
 
         tags: List[str] = ["art", "botArt"]
+        max_bytes = 8 << 20  # size limit for animations
 
         @staticmethod
         def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
+            parser.add_argument(
+                "--pockets",
+                choices=["fill", "tunnel"],
+                default=None,
+                help="fill in small caves, or tunnel from every cave to the largest",
+            )
+            parser.add_argument(
+                "--min-pocket",
+                type=int,
+                default=64,
+                help="caves smaller than this are filled in",
+            )
+            parser.add_argument(
+                "--size",
+                type=int,
+                nargs=2,
+                metavar=("WIDTH", "HEIGHT"),
+                default=None,
+                help="show a view of this size into an endless cave world",
+            )
+            parser.add_argument(
+                "--seed", type=int, default=None, help="which cave world to view"
+            )
+            parser.add_argument(
+                "--origin",
+                type=int,
+                nargs=2,
+                metavar=("X", "Y"),
+                default=(0, 0),
+                help="top left corner of the view into the cave world",
+            )
+            parser.add_argument(
+                "--output",
+                type=Path,
+                default=None,
+                help="stream the view into the cave world to this PNG file",
+            )
+            parser.add_argument(
+                "--animate",
+                action="store_true",
+                help="post an animation of the caves settling out of the noise",
+            )
             return parser
 
-        def run(self, _args: Namespace) -> BotResult:
+        def run(self, args: Namespace) -> BotResult:
+            if args.size or args.seed is not None or args.output:
+                return self.world(args)
             # imageRaw = fractalCaves(256).generate().render()
-            t = FractalCaves(64, iterations=2).generate().double()
+            t = FractalCaves(64, iterations=2)
+            if args.animate:
+                t.history = []
+            t.generate().double()
             t.smooth(1).double().smooth(1).double().smooth(4)
+            if args.pockets:
+                t.fill_pockets(args.min_pocket)
+            if args.pockets == "tunnel":
+                t.tunnel()
+            animation = t.animate(max_bytes=self.max_bytes) if args.animate else None
+            stats = t.cave_stats()
+            share = stats["largest"] * 100 // (t.x * t.y)
+            if stats["caves"] == 1:
+                caves = f"It is one connected cave, covering {share}% of the map."
+            else:
+                caves = f"It has {stats['caves']} separate caves, the largest covering {share}% of the map."
             image_raw = t.render()
+            return BotResult(
+                image_raw, tags=self.tags, animation=animation,
+                alt_text=f"A computer generated fractal map using the 5:4 algorithm. {caves}"
+            )
+
+        def world(self, args: Namespace) -> BotResult:
+            width, height = args.size or (512, 512)
+            world = CaveWorld(args.seed)
+            if args.output:
+                with args.output.open("wb") as fp:
+                    world.stream_png(fp, *args.origin, width, height)
+                image_raw = open_image(args.output)
+            else:
+                image_raw = world.render(*args.origin, width, height)
             return BotResult(
                 image_raw, tags=self.tags,
-                alt_text="A computer generated fractal map using the 5:4 algorithm."
+                alt_text=" ".join([
+                    "A computer generated fractal map using the 5:4 algorithm.",
+                    f"It shows {width} by {height} points of cave world {world.seed},",
+                    f"from {args.origin[0]}, {args.origin[1]}.",
+                ])
             )
 
 except ImportError:
@@ -39,7 +119,13 @@ except ImportError:
 
 
 class FractalCaves():
-    ''' a bad implmentation of a fractal map using 5:4 '''
+    ''' a bad implmentation of a fractal map using 5:4,
+        on a toroidal boolean array of land, indexed [y, x] '''
+
+    # render colour for each count of land in a 3x3 neighbourhood
+    colours = np.array([
+        (0, 32 * pc - 1, 255 - (32 * pc - 1)) for pc in range(10)
+    ])
 
     def __init__(self, x: int = 64, y: Optional[int] = None, iterations=5):
         self.x = x
@@ -48,62 +134,40 @@ class FractalCaves():
         else:
             self.y = x
         self.iterations = iterations
-        self.land: Dict[Tuple[int, int], bool] = collections.defaultdict(bool)
+        self.land = np.zeros((self.y, self.x), dtype=bool)
+        # set to a list to keep the neighbour counts of every generation
+        self.history: Optional[List[np.ndarray]] = None
+
+    def record(self):
+        ''' keep the current generation for animate(), if recording '''
+        if self.history is not None:
+            self.history.append(self.neighbours())
 
     def reset(self):
         ''' reset the land '''
-        self.land = collections.defaultdict(bool)
-        for x in range(self.x):
-            for y in range(self.y):
-                self.land[(x, y)] = random.random() > 0.55
+        rng = np.random.default_rng(random.getrandbits(64))
+        self.land = rng.random((self.y, self.x)) > 0.55
+        self.record()
 
     def double(self) -> FractalCaves:
         ''' double the resolution '''
-        new_land = collections.defaultdict(bool)
         self.x = self.x * 2
         self.y = self.y * 2
-        for x in range(0, self.x, 2):
-            for y in range(0, self.y, 2):
-                v = self.land[(int(x / 2), int(y / 2))]
-                new_land[(x, y)] = v
-                new_land[(x + 1, y)] = v
-                new_land[(x, y + 1)] = v
-                new_land[(x + 1, y + 1)] = v
-        self.land = new_land
+        self.land = self.land.repeat(2, axis=0).repeat(2, axis=1)
+        self.record()
         return self
 
-    def normed(self, x, y):
-        ''' normalise a point based upon the surrounding points '''
-        pc = 0
-        for xo in range(x - 1, x + 2):
-            xx = xo % self.x
-            for yo in range(y - 1, y + 2):
-                yy = yo % self.y
-                if self.land[(xx, yy)]:
-                    pc = pc + 1
-        return pc > 4
-
-    def antialias(self, x, y):
-        ''' bad antialising '''
-        pc = 0
-        for xo in range(x - 1, x + 2):
-            xx = xo % self.x
-            for yo in range(y - 1, y + 2):
-                yy = yo % self.y
-                if self.land[(xx, yy)]:
-                    pc = pc + 1
-        g = 32 * pc - 1
-        b = 255 - g
-        return (0, g, b)
+    def neighbours(self) -> np.ndarray:
+        ''' count the land in the 3x3 block around every point, wrapping at the edges '''
+        land = self.land.view(np.uint8)
+        rows = land + np.roll(land, 1, axis=0) + np.roll(land, -1, axis=0)
+        return rows + np.roll(rows, 1, axis=1) + np.roll(rows, -1, axis=1)
 
     def smooth(self, iterations) -> FractalCaves:
         ''' smoothing '''
         for _ in range(iterations):
-            new_land = collections.defaultdict(bool)
-            for x in range(self.x):
-                for y in range(self.y):
-                    new_land[(x, y)] = self.normed(x, y)
-            self.land = new_land
+            self.land = self.neighbours() > 4
+            self.record()
         return self
 
     def generate(self) -> FractalCaves:
@@ -112,22 +176,233 @@ class FractalCaves():
         self.smooth(self.iterations)
         return self
 
+    def regions(self) -> Tuple[np.ndarray, np.ndarray]:
+        ''' label the connected caves (open points, joined up, down, left and
+            right, wrapping at the edges), numbered from largest to smallest;
+            returns the labels, -1 for land, and the size of each cave '''
+        floor = ~self.land
+        # number the horizontal runs of floor, a run of floor across the
+        # right hand edge continues on the left, so join those up too
+        starts = floor & ~np.roll(floor, 1, axis=1)
+        starts[:, 0] = floor[:, 0]
+        run = np.cumsum(starts).reshape(floor.shape) - 1
+        runs = int(starts.sum())
+
+        # runs in neighbouring rows touch over a span of columns, the first
+        # of which is where one of them starts, so only look there
+        below = np.roll(floor, -1, axis=0) & floor
+        below &= starts | np.roll(starts, -1, axis=0)
+        pairs = np.concatenate([
+            np.stack([run[below], np.roll(run, -1, axis=0)[below]], axis=1),
+            np.stack([run[:, -1], run[:, 0]], axis=1)[floor[:, -1] & floor[:, 0]],
+        ])
+
+        parent = list(range(runs))
+
+        def find(node: int) -> int:
+            root = node
+            while parent[root] != root:
+                root = parent[root]
+            while parent[node] != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        for first, second in pairs.tolist():
+            first, second = find(first), find(second)
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+
+        roots = np.array([find(x) for x in range(runs)], dtype=np.int64)
+        sizes = np.bincount(roots, weights=np.bincount(run[floor], minlength=runs))
+        caves = np.flatnonzero(sizes)
+        order = caves[np.argsort(-sizes[caves], kind="stable")]
+        rank = np.full(runs, -1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        labels = np.full(floor.shape, -1, dtype=np.int64)
+        labels[floor] = rank[roots][run[floor]]
+        return labels, sizes[order].astype(np.int64)
+
+    def cave_stats(self) -> Dict[str, int]:
+        ''' how many caves there are, and how big '''
+        _, sizes = self.regions()
+        if not len(sizes):
+            return {"caves": 0, "largest": 0, "smallest": 0, "mean": 0, "floor": 0}
+        return {
+            "caves": len(sizes),
+            "largest": int(sizes[0]),
+            "smallest": int(sizes[-1]),
+            "mean": int(sizes.mean()),
+            "floor": int(sizes.sum()),
+        }
+
+    def fill_pockets(self, min_size: int = 64) -> FractalCaves:
+        ''' fill in every cave smaller than min_size, bar the largest '''
+        labels, sizes = self.regions()
+        if len(sizes) == 0:
+            return self
+        small = sizes < min_size
+        small[:1] = False
+        self.land |= small[labels] & (labels >= 0)
+        self.record()
+        return self
+
+    def tunnel(self, width: int = 3) -> FractalCaves:
+        ''' dig a tunnel from every cave to the nearest point of the largest '''
+        labels, sizes = self.regions()
+        if len(sizes) < 2:
+            return self
+        # the nearest point of the largest cave is always on its edge
+        main = np.argwhere((labels == 0) & (self.neighbours() > 0))
+        # any point will do to start from in each of the other caves
+        flat = labels.ravel()
+        points = np.flatnonzero(flat > 0)
+        start = np.zeros(len(sizes), dtype=np.int64)
+        start[flat[points]] = points
+        for cave in range(1, len(sizes)):
+            point = np.array(divmod(int(start[cave]), self.x))
+            end = main[np.argmin(((main - point) ** 2).sum(axis=1))]
+            self.dig(point, end, width)
+        self.record()
+        return self
+
+    def dig(self, start: np.ndarray, end: np.ndarray, width: int = 3):
+        ''' clear an L shaped tunnel between two (y, x) points '''
+        (y0, x0), (y1, x1) = start, end
+        low, high = -(width // 2), width - width // 2
+        self.land[
+            max(y0 + low, 0):y0 + high, max(min(x0, x1) + low, 0):max(x0, x1) + high
+        ] = False
+        self.land[
+            max(min(y0, y1) + low, 0):max(y0, y1) + high, max(x1 + low, 0):x1 + high
+        ] = False
+
     def render(self) -> Image:
         ''' render to a PIL.Image '''
-        img = NewImage("RGB", (
-            self.x, self.y
-        ))
-        draw = ImageDraw.Draw(img)
-
-        for p in self.land.keys():
-            # if(self.land[p]):
-            #    col=(0,255,0)
-            # else:
-            #    col=(0,0,255)
-            # draw.point([p], col)
-            draw.point([p], self.antialias(*p))
-
-        return img
+        return array_image(self.neighbours(), self.colours)
+
+    def animate(self, delay: int = 300, hold: int = 3000, max_bytes: int = 8 << 20) -> bytes:
+        ''' play back the recorded generations as an animated PNG, holding
+            the last for hold ms; the generations in between are thinned
+            out until it fits in max_bytes '''
+        if not self.history:
+            raise ValueError("set history = [] before generate() to animate")
+        every = 1
+        while True:
+            frames = self.history[:-1:every] + self.history[-1:]
+            data = self.replay(frames, delay, hold)
+            if len(data) <= max_bytes or len(frames) <= 2:
+                return data
+            every *= 2
+
+    def replay(self, frames: List[np.ndarray], delay: int, hold: int) -> bytes:
+        ''' encode generations, scaled up to the final size, as frames
+            holding just the part that changed since the frame before '''
+        palette = np.clip(self.colours, 0, 255).astype(np.uint8).tobytes()
+        height, width = frames[-1].shape
+        png = ApngWriter((width, height), palette)
+        previous = None
+        for count, counts in enumerate(frames):
+            frame = counts.repeat(height // counts.shape[0], axis=0)
+            frame = frame.repeat(width // counts.shape[1], axis=1)
+            frame_delay = hold if count == len(frames) - 1 else delay
+            if previous is None:
+                png.add_frame(frame, delay=frame_delay)
+            else:
+                changed = frame != previous
+                rows = np.flatnonzero(changed.any(axis=1))
+                cols = np.flatnonzero(changed.any(axis=0))
+                if len(rows):
+                    top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+                else:
+                    top, bottom, left, right = 0, 1, 0, 1
+                png.add_frame(
+                    frame[top:bottom, left:right], (int(left), int(top)), frame_delay
+                )
+            previous = frame
+        return png.getvalue()
+
+
+class CaveWorld():
+    ''' an endless cave map, made in square chunks
+
+        Every chunk starts from coarse noise seeded by the world seed and the
+        chunk's position, then goes through the same smooth and double steps
+        as the Caves command. A chunk also takes in enough of its neighbours'
+        noise around the edge for those steps to come out exactly as they
+        would on one huge map, so chunks join up seamlessly and each can be
+        made on its own, in any order. '''
+
+    # smooth iterations at each resolution, doubling in between
+    steps = [2, 1, 1, 4]
+
+    def __init__(self, seed: Optional[int] = None, chunk_size: int = 256, cache_size: int = 256):
+        self.seed = random.getrandbits(31) if seed is None else seed
+        self.scale = 2 ** (len(self.steps) - 1)
+        if chunk_size % self.scale:
+            raise ValueError(f"chunk_size must be a multiple of {self.scale}")
+        self.chunk_size = chunk_size
+        self.coarse = chunk_size // self.scale
+
+        # how much noise beyond the chunk's own the steps need, worked backwards
+        margin = 0
+        for iterations in reversed(self.steps[1:]):
+            margin = -(-(margin + iterations) // 2)
+        self.margin = margin + self.steps[0]
+        if self.margin > self.coarse:
+            raise ValueError(f"chunk_size must be at least {self.margin * self.scale}")
+
+        self.chunk = functools.lru_cache(maxsize=cache_size)(self.make_chunk)
+
+    def noise(self, row: int, col: int) -> np.ndarray:
+        ''' the starting land for chunk (row, col), at the coarsest resolution '''
+        rng = np.random.default_rng([self.seed, row & 0xFFFFFFFF, col & 0xFFFFFFFF])
+        return rng.random((self.coarse, self.coarse)) > 0.55
+
+    def make_chunk(self, row: int, col: int) -> np.ndarray:
+        ''' the land for chunk (row, col), uncached, see chunk() '''
+        coarse, margin = self.coarse, self.margin
+        noise = np.block([
+            [self.noise(row + y, col + x) for x in (-1, 0, 1)] for y in (-1, 0, 1)
+        ])[coarse - margin : 2 * coarse + margin, coarse - margin : 2 * coarse + margin]
+
+        caves = FractalCaves(noise.shape[1], noise.shape[0])
+        caves.land = noise
+        # smoothing wraps at the edges, which spoils another point in from
+        # the edge each iteration, but never as far in as the chunk itself
+        for step, iterations in enumerate(self.steps):
+            if step:
+                caves.double()
+            caves.smooth(iterations)
+        edge = margin * self.scale
+        return caves.land[edge : edge + self.chunk_size, edge : edge + self.chunk_size]
+
+    def window(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        ''' the land from (x, y) to (x + width, y + height), indexed [y, x] '''
+        size = self.chunk_size
+        rows = range(y // size, (y + height - 1) // size + 1)
+        cols = range(x // size, (x + width - 1) // size + 1)
+        land = np.block([[self.chunk(row, col) for col in cols] for row in rows])
+        top, left = y - rows[0] * size, x - cols[0] * size
+        return land[top : top + height, left : left + width]
+
+    def pixels(self, x: int, y: int, width: int, height: int) -> np.ndarray:
+        ''' the land counts FractalCaves.render colours by, for a view '''
+        caves = FractalCaves(width + 2, height + 2)
+        caves.land = self.window(x - 1, y - 1, width + 2, height + 2)
+        return caves.neighbours()[1:-1, 1:-1]
+
+    def render(self, x: int, y: int, width: int, height: int) -> Image:
+        ''' render a view of the world to a PIL.Image '''
+        return array_image(self.pixels(x, y, width, height), FractalCaves.colours)
+
+    def stream_png(self, fp: BinaryIO, x: int, y: int, width: int, height: int):
+        ''' write a view of the world as a PNG, a band of chunks at a time '''
+        palette = np.clip(FractalCaves.colours, 0, 255).astype(np.uint8).tobytes()
+        with PngWriter(fp, (width, height), "P", palette) as png:
+            for top in range(y, y + height, self.chunk_size):
+                rows = min(self.chunk_size, y + height - top)
+                png.write(self.pixels(x, top, width, rows))
 
 
 if __name__ == "__main__":
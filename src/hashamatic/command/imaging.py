@@ -0,0 +1,206 @@
+''' shared image helpers for the generators in this package '''
+from __future__ import annotations
+
+import functools
+import logging
+import os
+import struct
+import zlib
+from typing import BinaryIO, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image, ImageFont
+
+# candidate fonts for each role, tried in order,
+# after any path in the HASHAMATIC_<ROLE>_FONT environment variable
+font_paths: Dict[str, List[str]] = {
+    "mono": [
+        "/usr/share/fonts/truetype/noto/NotoMono-Regular.ttf",
+        "NotoMono-Regular.ttf",
+        "DejaVuSansMono.ttf",
+    ],
+    "symbol": [
+        "/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf",
+        "Symbola_hint.ttf",
+        "Symbola.ttf",
+    ],
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    ''' load a TrueType font, once per process for each path and size '''
+    return ImageFont.truetype(path, size)
+
+
+def find_font(role: str, size: int) -> ImageFont.FreeTypeFont:
+    ''' load the first available font for a role (see font_paths) '''
+    candidates = font_paths[role]
+    override = os.environ.get(f"HASHAMATIC_{role.upper()}_FONT")
+    if override:
+        candidates = [override] + candidates
+    for path in candidates:
+        try:
+            return load_font(path, size)
+        except OSError:
+            logging.debug("font %s not found", path)
+    raise OSError(f"no {role} font found, tried {', '.join(candidates)}")
+
+
+def array_image(
+    channels: np.ndarray, lut: Optional[np.ndarray] = None, mode: str = "RGB"
+) -> Image.Image:
+    ''' build an image straight from arrays of 0..255 values, either one
+        (rows, cols) array per band of mode, or a single (rows, cols) array
+        of intensities coloured through lut, up to 256 (r, g, b) rows '''
+    channels = np.asarray(channels)
+    if channels.dtype != np.uint8:
+        channels = np.clip(channels, 0, 255).astype(np.uint8)
+    channels = np.ascontiguousarray(channels)
+    if channels.ndim == 2:
+        channels = channels[np.newaxis]
+    size = (channels.shape[2], channels.shape[1])
+    bands = [Image.frombuffer("L", size, band, "raw", "L", 0, 1) for band in channels]
+
+    if lut is not None:
+        table = np.zeros((256, 3), dtype=np.uint8)
+        lut = np.clip(np.asarray(lut).reshape(-1, 3), 0, 255)
+        table[:len(lut)] = lut
+        return Image.merge("RGB", [bands[0].point(list(band)) for band in table.T])
+    if len(bands) == 1:
+        return bands[0].convert(mode)
+    return Image.merge(mode, bands)
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    ''' a single PNG chunk: length, type, data and crc '''
+    return b"".join([
+        struct.pack(">I", len(data)),
+        kind,
+        data,
+        struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))),
+    ])
+
+
+def png_scanlines(band: np.ndarray) -> bytes:
+    ''' rows of pixels as PNG scanlines, each with filter type 0 (none) '''
+    band = np.asarray(band, dtype=np.uint8)
+    band = band.reshape(band.shape[0], -1)
+    filtered = np.zeros((band.shape[0], band.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 1:] = band
+    return filtered.tobytes()
+
+
+class PngWriter():
+    ''' writes a PNG a band of rows at a time,
+        so the whole image never has to be held in memory '''
+
+    colour_types = {"L": (0, 1), "RGB": (2, 3), "P": (3, 1)}
+    chunk_size = 1 << 16
+
+    def __init__(
+        self,
+        fp: BinaryIO,
+        size: tuple[int, int],
+        mode: str = "RGB",
+        palette: Optional[Sequence[int]] = None
+    ) -> None:
+        if mode not in self.colour_types:
+            raise ValueError(f"unsupported PNG mode {mode}")
+        self.fp = fp
+        self.width, self.height = size
+        self.mode = mode
+        self.rows = 0
+        self.compressor = zlib.compressobj()
+        self.pending = b""
+
+        colour_type, self.channels = self.colour_types[mode]
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        self.chunk(b"IHDR", struct.pack(
+            ">IIBBBBB", self.width, self.height, 8, colour_type, 0, 0, 0
+        ))
+        if mode == "P":
+            if not palette:
+                raise ValueError("palette mode needs a palette")
+            self.chunk(b"PLTE", bytes(palette))
+
+    def chunk(self, kind: bytes, data: bytes) -> None:
+        ''' write a single PNG chunk '''
+        self.fp.write(png_chunk(kind, data))
+
+    def write(self, band: np.ndarray) -> None:
+        ''' append rows, shaped (rows, width) or (rows, width, 3) for RGB '''
+        band = np.asarray(band, dtype=np.uint8).reshape(
+            -1, self.width * self.channels
+        )
+        if self.rows + len(band) > self.height:
+            raise ValueError("too many rows for this PNG")
+        self.rows += len(band)
+        self.pending += self.compressor.compress(png_scanlines(band))
+        if len(self.pending) >= self.chunk_size:
+            self.chunk(b"IDAT", self.pending)
+            self.pending = b""
+
+    def close(self) -> None:
+        ''' flush the image data and finish the file '''
+        if self.rows != self.height:
+            raise ValueError(f"PNG has {self.rows} of {self.height} rows")
+        self.chunk(b"IDAT", self.pending + self.compressor.flush())
+        self.pending = b""
+        self.chunk(b"IEND", b"")
+
+    def __enter__(self) -> PngWriter:
+        return self
+
+    def __exit__(self, exc_type, _exc, _tb) -> None:
+        if exc_type is None:
+            self.close()
+
+
+class ApngWriter():
+    ''' builds an animated, palette mode PNG from a full first frame
+        followed by sub-rectangle updates, compressing each frame as it is added '''
+
+    def __init__(
+        self, size: tuple[int, int], palette: Sequence[int], loops: int = 0
+    ) -> None:
+        self.width, self.height = size
+        self.palette = bytes(palette)
+        self.loops = loops
+        self.frames: List[bytes] = []
+        self.sequence = 0
+        self.size = 0
+
+    def add_frame(
+        self, pixels: np.ndarray, offset: tuple[int, int] = (0, 0), delay: int = 40
+    ) -> None:
+        ''' add a frame of palette indexes at offset (x, y), shown for delay ms;
+            it is drawn over the previous frame '''
+        height, width = pixels.shape
+        if not self.frames and (width, height, offset) != (self.width, self.height, (0, 0)):
+            raise ValueError("the first frame must cover the whole image")
+        data = zlib.compress(png_scanlines(pixels))
+        frame = [png_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self.sequence, width, height, *offset, delay, 1000, 0, 0
+        ))]
+        self.sequence += 1
+        if self.frames:
+            frame.append(png_chunk(b"fdAT", struct.pack(">I", self.sequence) + data))
+            self.sequence += 1
+        else:
+            frame.append(png_chunk(b"IDAT", data))
+        self.frames.append(b"".join(frame))
+        self.size += len(self.frames[-1])
+
+    def getvalue(self) -> bytes:
+        ''' the finished file '''
+        return b"".join([
+            b"\x89PNG\r\n\x1a\n",
+            png_chunk(b"IHDR", struct.pack(
+                ">IIBBBBB", self.width, self.height, 8, 3, 0, 0, 0
+            )),
+            png_chunk(b"acTL", struct.pack(">II", len(self.frames), self.loops)),
+            png_chunk(b"PLTE", self.palette),
+            *self.frames,
+            png_chunk(b"IEND", b""),
+        ])
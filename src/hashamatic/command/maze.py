@@ -4,15 +4,22 @@ from __future__ import annotations
 
 import collections
 import collections.abc
+import functools
 import logging
 import random
 from argparse import ArgumentParser, Namespace
-from typing import Dict, List, Sequence, Tuple, Union, Optional
-
-from PIL import ImageDraw, ImageFont
-from PIL.Image import Image
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import ImageDraw
+from PIL.Image import Image, frombytes, fromarray
+from PIL.Image import open as open_image
 from PIL.Image import new as NewImage
 
+from .imaging import ApngWriter, PngWriter, find_font
+
 try:
     from hashamatic.command import BotCmd, BotResult, iRandom, iWallpaper
 
@@ -29,15 +36,56 @@ try:
     class Maze(_Maze, iRandom, iWallpaper):
         """A Random Maze"""
 
+        candidates = 4  # mazes generated by random() to pick the hardest from
+        max_bytes = 8 << 20  # size limit for animations
+
         @staticmethod
         def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
             parser.add_argument("rows", type=int, nargs="?", default=None)
             parser.add_argument("columns", type=int, nargs="?", default=None)
+            parser.add_argument(
+                "--algorithm", choices=MazeMaker.algorithms, default="backtracker"
+            )
+            parser.add_argument(
+                "--output",
+                type=Path,
+                default=None,
+                help="stream an eller maze of any size to this PNG file",
+            )
+            parser.add_argument(
+                "--candidates",
+                type=int,
+                default=1,
+                help="generate this many mazes and post the hardest",
+            )
+            parser.add_argument(
+                "--spoiler", action="store_true", help="reply with the solution"
+            )
+            parser.add_argument(
+                "--animate",
+                action="store_true",
+                help="post an animation of the backtracker carving the maze",
+            )
+            parser.add_argument(
+                "--frames", type=int, default=200, help="most frames to animate"
+            )
             return parser
 
         def run(self, args: Namespace) -> BotResult:
             cols = args.columns
             rows = args.rows
+            if args.output:
+                # streamed row by row, so no need to limit the size
+                rows = max(rows or random.randint(12, 32), 1)
+                cols = max(cols or rows, 1)
+                with args.output.open("wb") as fp:
+                    MazeMaker.stream_eller(fp, cols, rows, 16)
+                return BotResult(
+                    open_image(args.output),
+                    text=self.caption,
+                    tags=self.tags,
+                    alt_text=f"A computer generated {rows} by {cols} maze.",
+                )
             if not rows:
                 rows = random.randint(12, 32)
             else:
@@ -48,20 +96,53 @@ try:
             else:
                 cols = max(cols, 1)
                 cols = min(cols, 120)
-            maker = MazeMaker(width=cols, height=rows)
-            maker.generate()
-            image_raw = maker.render(16)
-            return BotResult(
+            algorithm = "backtracker" if args.animate else args.algorithm
+            if args.candidates > 1:
+                maker = hardest_maze(
+                    cols, rows, algorithm, args.candidates, args.animate
+                )
+            else:
+                maker = MazeMaker(width=cols, height=rows)
+                if args.animate:
+                    maker.history = []
+                maker.carve(algorithm)
+            floor_color = MazeMaker.floor_colour()
+            image_raw = maker.render(16, floor_color=floor_color)
+            animation = None
+            if args.animate:
+                animation = maker.animate(
+                    16, max_frames=args.frames, max_bytes=self.max_bytes,
+                    floor_color=floor_color,
+                )
+            stats = maker.difficulty()
+            post = BotResult(
                 image_raw,
+                animation=animation,
                 text=self.caption,
                 tags=self.tags,
-                alt_text=f"A computer generated {rows} by {cols} maze.",
+                alt_text=" ".join(
+                    [
+                        f"A computer generated {rows} by {cols} maze.",
+                        f"The route through is {stats['path']} cells long,",
+                        f"passing {stats['dead_ends']} dead ends in the maze.",
+                    ]
+                ),
             )
+            if args.spoiler:
+                post.append(
+                    BotResult(
+                        maker.draw_path(image_raw.copy(), 16),
+                        text="My solution.",
+                        alt_text="The same maze with the route through drawn on.",
+                        warning="Spoiler: My solution",
+                    )
+                )
+            return post
 
         def random(self) -> BotResult:
             size = random.randint(12, 32)
             parser = self.add_argparse_arguments(ArgumentParser())
-            args = parser.parse_args(f"{size}".split())
+            args = parser.parse_args(f"{size} --candidates {self.candidates}".split())
             return self.run(args)
 
         def wallpaper(self) -> BotResult:
@@ -153,36 +234,56 @@ except ImportError:
     logging.debug("failed to import BotCmd interface")
 
 
-class MazeCell:
-    """represents one cell within the maze"""
-
-    def __init__(self):
-        self.solid = False
-        self.visited = False
-        self.right = self.left = self.top = self.bottom = True
-
-    def __str__(self):
-        bits = 0
-        if self.left:
-            bits = bits + 1
-        if self.right:
-            bits = bits + 2
-        if self.top:
-            bits = bits + 4
-        if self.bottom:
-            bits = bits + 8
-        return f"{bits:4b}"
+# each cell of the maze is one byte of flags
+LEFT = 1
+RIGHT = 2
+TOP = 4
+BOTTOM = 8
+WALLS = LEFT | RIGHT | TOP | BOTTOM
+VISITED = 16
+SOLID = 32
+# number of open sides for each combination of wall bits
+EXITS = np.array([4 - bin(x).count("1") for x in range(WALLS + 1)], dtype=np.uint8)
 
 
 class MazeMaker:
     """
     https://en.wikipedia.org/wiki/Maze_generation_algorithm"""
 
+    algorithms = ["backtracker", "eller"]
+
     def __init__(self, width: int = 48, height: Optional[int] = None):
         self.width = self.height = width
         if height:
             self.height = height
-        self.maze: Dict[Tuple[int, int], MazeCell] = collections.defaultdict(MazeCell)
+        # cells are 1..width by 1..height, with a visited border round them
+        self.stride = self.width + 2
+        self.maze = bytearray([WALLS]) * (self.stride * (self.height + 2))
+        border = WALLS | VISITED
+        self.maze[: self.stride] = bytes([border]) * self.stride
+        self.maze[-self.stride :] = bytes([border]) * self.stride
+        self.maze[:: self.stride] = bytes([border]) * (self.height + 2)
+        self.maze[self.width + 1 :: self.stride] = bytes([border]) * (self.height + 2)
+        # set to a list to record (from, to) for each cell carved by generate()
+        self.history: Optional[List[Tuple[int, int]]] = None
+
+    def index(self, xpos: int, ypos: int) -> int:
+        """position of a cell in self.maze"""
+        return ypos * self.stride + xpos
+
+    def set_solid(self, xpos: int, ypos: int):
+        """marks a cell as solid (and so visited)"""
+        if 0 <= xpos <= self.width + 1 and 0 <= ypos <= self.height + 1:
+            self.maze[self.index(xpos, ypos)] |= VISITED | SOLID
+
+    @classmethod
+    def from_mask(cls, mask: Image) -> MazeMaker:
+        """returns a MazeMaker the size of a 1 bit image,
+        with its set pixels as solid cells"""
+        maker = cls(mask.width, mask.height)
+        cells = np.frombuffer(maker.maze, dtype=np.uint8).reshape(-1, maker.stride)
+        cells[: mask.height, : mask.width][np.asarray(mask)] |= VISITED | SOLID
+        return maker
 
     @classmethod
     def from_text(cls, text: Union[Sequence[str], str], padding: int) -> MazeMaker:
@@ -191,157 +292,138 @@ class MazeMaker:
             if len(text) > 3:
                 text = text[:3]
             text = "\n".join(text)
-        fnt = ImageFont.truetype(
-            "/usr/share/fonts/truetype/noto/NotoMono-Regular.ttf", 32
-        )
+        fnt = find_font("mono", 32)
         (left, top, right, bottom) = ImageDraw.Draw(
             NewImage("1", (1, 1))
         ).multiline_textbbox((0, 0), text, font=fnt)
         logging.debug("%d %d %d %d", left, top, right, bottom)
-        maker = cls(right + 2 * padding, bottom + 2 * padding)
         im = NewImage("1", (right + 2 * padding, bottom + 2 * padding))
         d = ImageDraw.Draw(im)
         d.multiline_text((padding + 1, padding), text, 1, font=fnt, align="center")
-        px = im.load()
-        for xpos in range(0, right + 2 * padding):
-            for ypos in range(0, bottom + 2 * padding):
-                if px[xpos, ypos]:
-                    maker.maze[(xpos, ypos)].visited = True
-                    maker.maze[(xpos, ypos)].solid = True
-        return maker
+        return cls.from_mask(im)
 
     @classmethod
     def from_emoji(cls, emoji: str, padding: int) -> MazeMaker:
         """returns a MazeMaker that makes a maze around an emoji"""
-        fnt = ImageFont.truetype(
-            "/usr/share/fonts/truetype/ancient-scripts/Symbola_hint.ttf", 48
-        )
+        fnt = find_font("symbol", 48)
         (left, top, right, bottom) = ImageDraw.Draw(
             NewImage("1", (1, 1))
         ).multiline_textbbox((0, 0), emoji[:1], font=fnt)
         logging.debug("%d %d %d %d", left, top, right, bottom)
-        maker = cls(right + 2 * padding, bottom + 2 * padding)
         im = NewImage("1", (right + 2 * padding, bottom + 2 * padding))
         d = ImageDraw.Draw(im)
         d.multiline_text((padding + 1, padding), emoji, 1, font=fnt, align="center")
-        px = im.load()
-        for xpos in range(0, right + 2 * padding):
-            for ypos in range(0, bottom + 2 * padding):
-                if px[xpos, ypos]:
-                    maker.maze[(xpos, ypos)].visited = True
-                    maker.maze[(xpos, ypos)].solid = True
-        return maker
+        return cls.from_mask(im)
 
     def apply_shape(self, shape: List[List[int]], xos: int, yos: int):
         """applies the supplied shape as a solid section of maze"""
         for ypos, xdata in enumerate(shape):
             for xpos, solid in enumerate(xdata):
                 if solid:
-                    self.maze[(xpos + xos + 1, ypos + yos + 1)].visited = True
-                    self.maze[(xpos + xos + 1, ypos + yos + 1)].solid = True
+                    self.set_solid(xpos + xos + 1, ypos + yos + 1)
 
-    def get_cell(self, xos: int, yos: int) -> MazeCell:
-        if not self.maze[(xos, yos)].visited:
+    def get_cell(self, xos: int, yos: int) -> int:
+        """returns the flags for a cell, generating round it if unvisited"""
+        pos = self.index(xos, yos)
+        if not self.maze[pos] & VISITED:
             self.generate(xos, yos)
-        return self.maze[(xos, yos)]
+        return self.maze[pos]
 
     def generate(self, xpos: int = 1, ypos: int = 1):
-        # set up
-        stack: list[tuple[int, int]] = []
-        self.maze[(xpos, ypos)].visited = True
-        stack.append((xpos, ypos))
+        """recursive backtracker from (xpos, ypos) over unvisited cells"""
+        maze = self.maze
+        stride = self.stride
+        # neighbour offset, wall to open here, wall to open there
+        steps = (
+            (-1, LEFT, RIGHT),
+            (1, RIGHT, LEFT),
+            (-stride, TOP, BOTTOM),
+            (stride, BOTTOM, TOP),
+        )
+        pos = self.index(xpos, ypos)
+        maze[pos] |= VISITED
+        stack = [pos]
+        history = self.history
+        if history is not None:
+            history.append((pos, pos))
 
-        # run
         while stack:
-            choices: list[tuple[int, int]] = []
-            valid_choices: list[tuple[int, int]] = []
-            if xpos > 1:
-                choices.append((xpos - 1, ypos))
-            if xpos < self.width:
-                choices.append((xpos + 1, ypos))
-            if ypos > 1:
-                choices.append((xpos, ypos - 1))
-            if ypos < self.height:
-                choices.append((xpos, ypos + 1))
-            for choice in choices:
-                if not self.maze[choice].visited:
-                    valid_choices.append(choice)
+            pos = stack[-1]
+            valid_choices = [x for x in steps if not maze[pos + x[0]] & VISITED]
             if not valid_choices:
-                (xpos, ypos) = stack.pop()
+                stack.pop()
                 continue
-            (new_x, new_y) = random.choice(valid_choices)
-            self.maze[(new_x, new_y)].visited = True
-            if new_x < xpos:
-                self.maze[(new_x, new_y)].right = self.maze[(xpos, ypos)].left = False
-            elif new_x > xpos:
-                self.maze[(new_x, new_y)].left = self.maze[(xpos, ypos)].right = False
-            elif new_y < ypos:
-                self.maze[(new_x, new_y)].bottom = self.maze[(xpos, ypos)].top = False
-            elif new_y > ypos:
-                self.maze[(new_x, new_y)].top = self.maze[(xpos, ypos)].bottom = False
-            else:
-                raise Exception("How did you get here?????")
-            (xpos, ypos) = (new_x, new_y)
-            stack.append((xpos, ypos))
+            (offset, here, there) = random.choice(valid_choices)
+            maze[pos] &= ~here
+            if history is not None:
+                history.append((pos, pos + offset))
+            pos += offset
+            maze[pos] = (maze[pos] & ~there) | VISITED
+            stack.append(pos)
         return self
 
-    def render(self, cell_size: int = 16, border: int = 1) -> Image:
-        img = NewImage("RGB", (self.width * cell_size, self.height * cell_size))
-        draw = ImageDraw.Draw(img)
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def cell_templates(cell_size: int, border: int, mask: bool) -> np.ndarray:
+        """floor pixels (1) for a cell of each possible set of flags,
+        indexed by flags & (WALLS | SOLID); mask ignores SOLID"""
+        templates = np.zeros((WALLS + SOLID + 1, cell_size, cell_size), dtype=np.uint8)
+        end = cell_size - 1
+        inner = cell_size - border - 1
+        for flags in range(WALLS + SOLID + 1):
+            tile = NewImage("L", (cell_size, cell_size))
+            draw = ImageDraw.Draw(tile)
+            if mask or not flags & SOLID:
+                draw.rectangle(((border, border), (inner, inner)), 1)
+            if not flags & LEFT:
+                draw.rectangle(((0, border), (border, inner)), 1)
+            if not flags & RIGHT:
+                draw.rectangle(((inner, border), (end, inner)), 1)
+            if not flags & TOP:
+                draw.rectangle(((border, 0), (inner, border)), 1)
+            if not flags & BOTTOM:
+                draw.rectangle(((border, inner), (inner, end)), 1)
+            templates[flags] = np.array(tile)
+        return templates
+
+    def fill_unvisited(self):
+        """generate mazes from any cells the first pass couldn't reach"""
+        cells = np.frombuffer(self.maze, dtype=np.uint8).reshape(-1, self.stride)
+        # column by column, to match the order cells used to be drawn in
+        for xpos, ypos in np.argwhere((cells.T & VISITED) == 0):
+            self.get_cell(int(xpos), int(ypos))
+
+    def rasterize(self, cell_size: int, border: int, mask: bool = False) -> np.ndarray:
+        """array of the floor (1) and walls (0), built by tiling cell templates"""
+        self.fill_unvisited()
+        cells = np.frombuffer(self.maze, dtype=np.uint8).reshape(-1, self.stride)
+        flags = cells[1:-1, 1:-1] & (WALLS | SOLID)
+        tiles = self.cell_templates(cell_size, border, mask)[flags]
+        return tiles.transpose(0, 2, 1, 3).reshape(
+            self.height * cell_size, self.width * cell_size
+        )
 
-        floor_color = "rgb(%d,%d,%d)" % (
+    @staticmethod
+    def floor_colour() -> Tuple[int, int, int]:
+        """a random light colour for the floor"""
+        return (
             random.choice(range(128, 256)),
             random.choice(range(128, 256)),
             random.choice(range(128, 256)),
         )
-        for xos in range(0, self.width):
-            for yos in range(0, self.height):
-                cell = self.get_cell(xos + 1, yos + 1)
-                xcs = xos * cell_size
-                ycs = yos * cell_size
-                if not cell.solid:
-                    draw.rectangle(
-                        (
-                            (xcs + border, ycs + border),
-                            (
-                                xcs + cell_size - border - 1,
-                                ycs + cell_size - border - 1,
-                            ),
-                        ),
-                        floor_color,
-                    )
-                if not cell.left:
-                    draw.rectangle(
-                        (
-                            (xcs, ycs + border),
-                            (xcs + border, ycs + cell_size - border - 1),
-                        ),
-                        floor_color,
-                    )
-                if not cell.right:
-                    draw.rectangle(
-                        (
-                            (xcs + cell_size - border - 1, ycs + border),
-                            (xcs + cell_size - 1, ycs + cell_size - border - 1),
-                        ),
-                        floor_color,
-                    )
-                if not cell.top:
-                    draw.rectangle(
-                        (
-                            (xcs + border, ycs),
-                            (xcs + cell_size - border - 1, ycs + border),
-                        ),
-                        floor_color,
-                    )
-                if not cell.bottom:
-                    draw.rectangle(
-                        (
-                            (xcs + border, ycs + cell_size - border - 1),
-                            (xcs + cell_size - border - 1, ycs + cell_size - 1),
-                        ),
-                        floor_color,
-                    )
+
+    def render(
+        self,
+        cell_size: int = 16,
+        border: int = 1,
+        floor_color: Optional[Tuple[int, int, int]] = None,
+    ) -> Image:
+        floor_color = floor_color or self.floor_colour()
+        img = fromarray(self.rasterize(cell_size, border))
+        img.putpalette((0, 0, 0) + floor_color)
+        img = img.convert("RGB")
+
+        draw = ImageDraw.Draw(img)
         draw.regular_polygon(
             (cell_size / 2, cell_size / 2, cell_size / 2),
             n_sides=5,
@@ -362,44 +444,306 @@ class MazeMaker:
         return img
 
     def render_as_mask(self, cell_size: int = 16) -> Image:
-        mask = NewImage("1", (self.width * cell_size, self.height * cell_size))
-        draw = ImageDraw.Draw(mask)
-
-        for xos in range(0, self.width):
-            for yos in range(0, self.height):
-                cell = self.get_cell(xos + 1, yos + 1)
-                xcs = xos * cell_size
-                ycs = yos * cell_size
-                draw.rectangle(
-                    ((xcs + 1, ycs + 1), (xcs + cell_size - 2, ycs + cell_size - 2)),
-                    True,
+        floor = self.rasterize(cell_size, 1, mask=True)
+        return frombytes(
+            "1", (floor.shape[1], floor.shape[0]), np.packbits(floor, axis=1).tobytes()
+        )
+
+    def animate(
+        self,
+        cell_size: int = 16,
+        border: int = 1,
+        max_frames: int = 200,
+        max_bytes: int = 8 << 20,
+        delay: int = 40,
+        floor_color: Optional[Tuple[int, int, int]] = None,
+    ) -> bytes:
+        """replay the recorded history as an animated PNG, showing every Nth
+        step so there are at most max_frames, then halving the frame count
+        until it fits in max_bytes"""
+        if self.history is None:
+            raise ValueError("set history = [] before generate() to animate")
+        floor_color = floor_color or self.floor_colour()
+        every = max(1, -(-len(self.history) // max(1, max_frames)))
+        while True:
+            data = self.replay(cell_size, border, every, delay, floor_color)
+            if len(data) <= max_bytes or every >= len(self.history):
+                return data
+            every *= 2
+
+    def replay(
+        self,
+        cell_size: int,
+        border: int,
+        every: int,
+        delay: int,
+        floor_color: Tuple[int, int, int],
+    ) -> bytes:
+        """encode the history as frames holding just the cells
+        repainted since the frame before"""
+        assert self.history is not None
+        stride = self.stride
+        width = self.width * cell_size
+        height = self.height * cell_size
+        templates = self.cell_templates(cell_size, border, False)
+        walls = {
+            -1: (LEFT, RIGHT),
+            1: (RIGHT, LEFT),
+            -stride: (TOP, BOTTOM),
+            stride: (BOTTOM, TOP),
+        }
+        # floor, then the cell being carved, then the start and finish markers
+        palette = (0, 0, 0) + floor_color + (255, 255, 255) + (0, 192, 0) + (192, 0, 0)
+        png = ApngWriter((width, height), palette)
+        canvas = np.zeros((height, width), dtype=np.uint8)
+        png.add_frame(canvas, delay=delay)
+
+        flags = bytearray(x | WALLS for x in self.maze)
+        dirty = [width, height, 0, 0]
+
+        def paint(pos: int, colour: int = 1):
+            ypos, xpos = divmod(pos, stride)
+            left, top = (xpos - 1) * cell_size, (ypos - 1) * cell_size
+            tile = templates[flags[pos] & (WALLS | SOLID)]
+            canvas[top : top + cell_size, left : left + cell_size] = tile * colour
+            dirty[:] = [
+                min(dirty[0], left),
+                min(dirty[1], top),
+                max(dirty[2], left + cell_size),
+                max(dirty[3], top + cell_size),
+            ]
+
+        def emit(frame_delay: int):
+            (left, top, right, bottom) = dirty
+            if left < right:
+                png.add_frame(
+                    canvas[top:bottom, left:right], (left, top), frame_delay
                 )
-                if not cell.left:
-                    draw.rectangle(
-                        ((xcs, ycs + 1), (xcs + 1, ycs + cell_size - 2)), True
-                    )
-                if not cell.right:
-                    draw.rectangle(
-                        (
-                            (xcs + cell_size - 2, ycs + 1),
-                            (xcs + cell_size - 1, ycs + cell_size - 2),
-                        ),
-                        True,
-                    )
-                if not cell.top:
-                    draw.rectangle(
-                        ((xcs + 1, ycs), (xcs + cell_size - 2, ycs + 1)), True
-                    )
-                if not cell.bottom:
-                    draw.rectangle(
-                        (
-                            (xcs + 1, ycs + cell_size - 2),
-                            (xcs + cell_size - 2, ycs + cell_size - 1),
-                        ),
-                        True,
-                    )
+            dirty[:] = [width, height, 0, 0]
+
+        head = None
+        for step, (here, there) in enumerate(self.history, 1):
+            if here != there:
+                (wall_here, wall_there) = walls[there - here]
+                flags[here] &= ~wall_here
+                flags[there] &= ~wall_there
+                paint(here)
+            if head is not None and head not in (here, there):
+                paint(head)
+            paint(there, 2)
+            head = there
+            if not step % every:
+                emit(delay)
+        if head is not None:
+            paint(head)
+
+        # finish on the whole maze with its start and finish marked
+        img = fromarray(canvas)
+        draw = ImageDraw.Draw(img)
+        half = cell_size / 2
+        draw.regular_polygon((half, half, half), n_sides=5, fill=3, rotation=-90)
+        draw.regular_polygon(
+            (width - half, height - half, half), n_sides=5, fill=4, rotation=90
+        )
+        canvas[:] = np.asarray(img)
+        dirty[:] = [0, 0, width, height]
+        emit(delay * 100)
+        return png.getvalue()
+
+    def rows(self) -> Iterator[bytes]:
+        """each row of cell flags, top to bottom"""
+        self.fill_unvisited()
+        for ypos in range(1, self.height + 1):
+            start = self.index(1, ypos)
+            yield bytes(self.maze[start : start + self.width])
+
+    @classmethod
+    def stream_png(
+        cls,
+        fp: BinaryIO,
+        rows: Iterable[bytes],
+        width: int,
+        height: int,
+        cell_size: int = 16,
+        border: int = 1,
+    ):
+        """render rows of cell flags straight into a PNG,
+        so only one row of cells is ever held as pixels"""
+        templates = cls.cell_templates(cell_size, border, False)
+        palette = (0, 0, 0) + cls.floor_colour() + (0, 192, 0) + (192, 0, 0)
+        half = cell_size / 2
+        with PngWriter(fp, (width * cell_size, height * cell_size), "P", palette) as png:
+            for ypos, row in enumerate(rows):
+                flags = np.frombuffer(row, dtype=np.uint8) & (WALLS | SOLID)
+                band = templates[flags].transpose(1, 0, 2).reshape(
+                    cell_size, width * cell_size
+                )
+                if ypos in (0, height - 1):
+                    img = fromarray(band)
+                    draw = ImageDraw.Draw(img)
+                    if ypos == 0:
+                        draw.regular_polygon(
+                            (half, half, half), n_sides=5, fill=2, rotation=-90
+                        )
+                    if ypos == height - 1:
+                        draw.regular_polygon(
+                            (width * cell_size - half, half, half),
+                            n_sides=5,
+                            fill=3,
+                            rotation=90,
+                        )
+                    band = np.asarray(img)
+                png.write(band)
 
-        return mask
+    @classmethod
+    def stream_eller(
+        cls, fp: BinaryIO, width: int, height: int, cell_size: int = 16, border: int = 1
+    ):
+        """generate and write a maze of any height in O(width) memory"""
+        cls.stream_png(
+            fp, cls.eller_rows(width, height), width, height, cell_size, border
+        )
+
+    @staticmethod
+    def eller_rows(width: int, height: int) -> Iterator[bytearray]:
+        """Eller's algorithm, yielding each row of cell flags once it is final
+        https://weblog.jamisbuck.org/2010/12/29/eller-s-algorithm"""
+        sets = [0] * width  # 0 for a cell not yet in a set
+        next_set = 1
+
+        def find(parent: Dict[int, int], label: int) -> int:
+            while label in parent:
+                label = parent[label]
+            return label
+
+        for ypos in range(height):
+            last = ypos == height - 1
+            row = bytearray([WALLS | VISITED]) * width
+            for xpos in range(width):
+                if sets[xpos]:
+                    row[xpos] &= ~TOP
+                else:
+                    sets[xpos] = next_set
+                    next_set += 1
+
+            # join neighbours in different sets, always on the last row
+            parent: Dict[int, int] = {}
+            for xpos in range(width - 1):
+                here = find(parent, sets[xpos])
+                there = find(parent, sets[xpos + 1])
+                if here != there and (last or random.getrandbits(1)):
+                    row[xpos] &= ~RIGHT
+                    row[xpos + 1] &= ~LEFT
+                    parent[there] = here
+            sets = [find(parent, x) for x in sets]
+
+            if not last:
+                # every set continues down at least once
+                members: Dict[int, List[int]] = collections.defaultdict(list)
+                for xpos, label in enumerate(sets):
+                    members[label].append(xpos)
+                below = [0] * width
+                for label, cells in members.items():
+                    down = random.choice(cells)
+                    for xpos in cells:
+                        if xpos == down or not random.getrandbits(2):
+                            row[xpos] &= ~BOTTOM
+                            below[xpos] = label
+                sets = below
+            yield row
+
+    def carve(self, algorithm: str = "backtracker"):
+        """generate the maze with the named algorithm"""
+        if algorithm == "eller":
+            return self.generate_eller()
+        return self.generate()
+
+    def solve(self) -> List[Tuple[int, int]]:
+        """breadth first search for the cells from the start (top left)
+        to the goal (bottom right), empty if there is no route"""
+        self.fill_unvisited()
+        maze = self.maze
+        steps = ((-1, LEFT), (1, RIGHT), (-self.stride, TOP), (self.stride, BOTTOM))
+        start = self.index(1, 1)
+        goal = self.index(self.width, self.height)
+        parent = {start: start}
+        queue = collections.deque([start])
+        while queue:
+            pos = queue.popleft()
+            if pos == goal:
+                break
+            for offset, wall in steps:
+                if not maze[pos] & wall and pos + offset not in parent:
+                    parent[pos + offset] = pos
+                    queue.append(pos + offset)
+        if goal not in parent:
+            return []
+        path = [goal]
+        while path[-1] != start:
+            path.append(parent[path[-1]])
+        return [divmod(x, self.stride)[::-1] for x in reversed(path)]
+
+    def difficulty(self) -> Dict[str, float]:
+        """path length, dead ends and branching factor of the solution,
+        plus a score combining them for picking the hardest maze"""
+        path = self.solve()
+        cells = np.frombuffer(self.maze, dtype=np.uint8).reshape(-1, self.stride)
+        cells = cells[1:-1, 1:-1]
+        exits = EXITS[cells & WALLS]
+        dead_ends = int(np.count_nonzero((exits == 1) & ((cells & SOLID) == 0)))
+        # choices offered at each step along the route, ignoring the way back
+        choices = [int(exits[y - 1, x - 1]) - 1 for x, y in path[1:-1]]
+        branching = sum(choices) / len(choices) if choices else 0.0
+        return {
+            "path": len(path),
+            "dead_ends": dead_ends,
+            "branching": branching,
+            "score": len(path) * (1 + branching),
+        }
+
+    def draw_path(self, img: Image, cell_size: int = 16) -> Image:
+        """draws the solution onto an image from render()"""
+        centres = [
+            ((x - 0.5) * cell_size, (y - 0.5) * cell_size) for x, y in self.solve()
+        ]
+        if len(centres) > 1:
+            ImageDraw.Draw(img).line(
+                centres, fill="rgb(64,64,255)", width=max(1, cell_size // 4), joint="curve"
+            )
+        return img
+
+    def generate_eller(self):
+        """fill the whole maze using Eller's algorithm (ignores solid cells)"""
+        for ypos, row in enumerate(self.eller_rows(self.width, self.height), 1):
+            start = self.index(1, ypos)
+            self.maze[start : start + self.width] = row
+        return self
+
+
+def scored_maze(
+    width: int, height: int, algorithm: str, record: bool = False
+) -> Tuple[float, MazeMaker]:
+    """generate a maze and score its difficulty, for use by pool workers"""
+    maker = MazeMaker(width, height)
+    if record:
+        maker.history = []
+    maker.carve(algorithm)
+    return maker.difficulty()["score"], maker
+
+
+def hardest_maze(
+    width: int, height: int, algorithm: str, candidates: int, record: bool = False
+) -> MazeMaker:
+    """generate candidate mazes across a process pool and keep the hardest"""
+    with ProcessPoolExecutor() as pool:
+        scored = pool.map(
+            scored_maze,
+            [width] * candidates,
+            [height] * candidates,
+            [algorithm] * candidates,
+            [record] * candidates,
+        )
+        return max(scored, key=lambda x: x[0])[1]
 
 
 if __name__ == "__main__":
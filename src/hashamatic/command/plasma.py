@@ -1,19 +1,26 @@
 """plasma/space cloud"""
 
-import collections
+from __future__ import annotations
+
 import logging
+import os
 import random
-from argparse import Namespace
-from typing import Dict, List, Tuple
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional, Tuple
 
-from PIL import ImageDraw
+import numpy as np
 from PIL.Image import Image
-from PIL.Image import new as NewImage
+from PIL.Image import open as open_image
+
+from hashamatic.cache import cache_dir
+
+from .imaging import ApngWriter, PngWriter, array_image
 
 try:
-    from hashamatic.command import BotCmd, BotResult, iRandom
+    from hashamatic.command import BotCmd, BotResult, iRandom, iWallpaper
 
-    class Plasma(BotCmd, iRandom):
+    class Plasma(BotCmd, iRandom, iWallpaper):
         """A randomly generated, multi-coloured, fractal plasma"""
 
         tags: List[str] = [
@@ -26,142 +33,350 @@ try:
             "botArt",
         ]
         caption = "Look at this space cloud I made."
+        alt_text = "A computer generated, multi-coloured, fractal plasma. Generated using the Diamond-Square algorithm."
+        max_bytes = 8 << 20  # size limit for animations
 
-        def run(self, _args: Namespace) -> BotResult:
+        @staticmethod
+        def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
+            parser.add_argument(
+                "--size",
+                type=int,
+                nargs=2,
+                metavar=("WIDTH", "HEIGHT"),
+                default=None,
+                help="build a tiled plasma of any size",
+            )
+            parser.add_argument(
+                "--output",
+                type=Path,
+                default=None,
+                help="stream a tiled plasma to this PNG file",
+            )
+            parser.add_argument(
+                "--animate",
+                action="store_true",
+                help="post a single plasma with its palette cycling",
+            )
+            parser.add_argument(
+                "--palette", choices=sorted(PaletteCycle.palettes), default=None
+            )
+            parser.add_argument(
+                "--seed",
+                type=int,
+                default=None,
+                help="animate this plasma, cached so it can be redone in other palettes",
+            )
+            parser.add_argument(
+                "--frames", type=int, default=64, help="most frames to animate"
+            )
+            return parser
+
+        def run(self, args: Namespace) -> BotResult:
+            if args.animate:
+                return self.cycle(args)
+            if args.output:
+                width, height = args.size or (1024, 1024)
+                with args.output.open("wb") as fp:
+                    TiledPlasma(width, height).stream_png(fp)
+                image_raw = open_image(args.output)
+            elif args.size:
+                image_raw = TiledPlasma(*args.size).render()
+            else:
+                image_raw = FractalMap(256).render()
             return BotResult(
-                FractalMap(256).render(),
+                image_raw,
                 text=self.caption,
                 tags=self.tags,
-                alt_text="A computer generated, multi-coloured, fractal plasma. Generated using the Diamond-Square algorithm.",
+                alt_text=self.alt_text,
+            )
+
+        def cycle(self, args: Namespace) -> BotResult:
+            width, height = args.size or (256, 256)
+            palette = args.palette or random.choice(sorted(PaletteCycle.palettes))
+            if args.seed is None:
+                plasma = PaletteCycle.generate(width, height)
+            else:
+                plasma = PaletteCycle.cached(width, height, args.seed)
+            return BotResult(
+                plasma.render(palette),
+                animation=plasma.animate(
+                    palette, max_frames=args.frames, max_bytes=self.max_bytes
+                ),
+                text=self.caption,
+                tags=self.tags,
+                alt_text=f"A computer generated fractal plasma, cycling through its {palette} palette.",
+            )
+
+        def wallpaper(self) -> BotResult:
+            return BotResult(
+                TiledPlasma(1080, 2400).render(),
+                text=self.caption,
+                tags=self.tags,
+                alt_text=self.alt_text,
             )
 except ImportError:
     logging.debug("failed to import BotCmd interface")
 
 
+def diamond_square(
+    heights: np.ndarray, step: int, rng: np.random.Generator, keep_edges: bool = False
+) -> np.ndarray:
+    """fill in a stack of height maps, shaped (channels, rows + 1, cols + 1),
+    whose points every step apart are already set; with keep_edges the
+    outside rows and columns are taken as already set too"""
+    while step > 1:
+        half = step // 2
+
+        # square step: the centre of each square from its corners
+        corners = heights[:, ::step, ::step]
+        centres = (
+            corners[:, :-1, :-1] + corners[:, :-1, 1:]
+            + corners[:, 1:, :-1] + corners[:, 1:, 1:]
+        ) / 4
+        centres += rng.normal(0, half, centres.shape)
+        heights[:, half::step, half::step] = centres
+
+        # diamond step: edge midpoints from the corners either side
+        # and the centres above and below (or left and right)
+        total = corners[:, :, :-1] + corners[:, :, 1:]
+        count = np.full(total.shape[1:], 2.0)
+        total[:, 1:] += centres
+        total[:, :-1] += centres
+        count[1:] += 1
+        count[:-1] += 1
+        total = total / count + rng.normal(0, half, total.shape)
+        if keep_edges:
+            heights[:, step:-1:step, half::step] = total[:, 1:-1]
+        else:
+            heights[:, ::step, half::step] = total
+
+        total = corners[:, :-1] + corners[:, 1:]
+        count = np.full(total.shape[1:], 2.0)
+        total[:, :, 1:] += centres
+        total[:, :, :-1] += centres
+        count[:, 1:] += 1
+        count[:, :-1] += 1
+        total = total / count + rng.normal(0, half, total.shape)
+        if keep_edges:
+            heights[:, half::step, step:-1:step] = total[:, :, 1:-1]
+        else:
+            heights[:, half::step, ::step] = total
+
+        step = half
+    return heights
+
+
 class FractalMap:
-    """a bad implmentation of a cloud fractal:
-    https://en.wikipedia.org/wiki/Diamond-square_algorithm"""
+    """a cloud fractal on NumPy arrays:
+    https://en.wikipedia.org/wiki/Diamond-square_algorithm
 
-    @staticmethod
-    def v(x: float) -> float:
-        return random.gauss(0, x)
+    heights cover xb by yb blocks of block_size (a power of two),
+    with each square and diamond step done for every point at once"""
 
     def __init__(self, block_size: int = 256, xb: int = 1, yb: int = 1):
+        if block_size < 1 or block_size & (block_size - 1):
+            raise ValueError(f"block_size must be a power of two, not {block_size}")
         self.block_size = block_size
         self.xb = xb
         self.yb = yb
-        self.heights: Dict[Tuple[int, int], float] = collections.defaultdict(float)
-
-    def reset(self):
-        self.heights = collections.defaultdict(float)
-
-    def plus_av(self, x: int, y: int, d: int):
-        if (x, y) in self.heights:
-            return
-
-        v: list[float] = list()
-        if (x - d, y) in self.heights:
-            v.append(self.heights[(x - d, y)])
-        if (x + d, y) in self.heights:
-            v.append(self.heights[(x + d, y)])
-        if (x, y - d) in self.heights:
-            v.append(self.heights[(x, y - d)])
-        if (x, y + d) in self.heights:
-            v.append(self.heights[(x, y + d)])
-        self.heights[(x, y)] = sum(v) / len(v) + self.v(d)
-
-    def cross_av(self, x: int, y: int, d: int):
-        if (x, y) in self.heights:
-            return
-        v: list[float] = list()
-        if (x - d, y - d) in self.heights:
-            v.append(self.heights[(x - d, y - d)])
-        if (x + d, y - d) in self.heights:
-            v.append(self.heights[(x + d, y - d)])
-        if (x - d, y + d) in self.heights:
-            v.append(self.heights[(x - d, y + d)])
-        if (x + d, y + d) in self.heights:
-            v.append(self.heights[(x + d, y + d)])
-        self.heights[(x, y)] = sum(v) / len(v) + self.v(d)
-
-    def mid_fill(self, x: int, y: int, s: int):
-        # A.2.A
-        # .3.3.
-        # 2.1.2
-        # .3.3.
-        # A.2.A
-
-        m = int(s / 2)
-        # now fill in 2
-        self.plus_av(x + m, y, m)
-        self.plus_av(x, y + m, m)
-        self.plus_av(x + m, y + s, m)
-        self.plus_av(x + s, y + m, m)
-
-        if m > 1:
-            n = int(m / 2)
-
-            # now fill in 3
-            self.cross_av(x + n, y + n, n)
-            self.cross_av(x + n + m, y + n, n)
-            self.cross_av(x + n, y + n + m, n)
-            self.cross_av(x + n + m, y + n + m, n)
-
-            # and recurse
-            self.mid_fill(x, y, m)
-            self.mid_fill(x + m, y, m)
-            self.mid_fill(x, y + m, m)
-            self.mid_fill(x + m, y + m, m)
-
-    def normalise(self):
-        mn = mx = self.heights[(0, 0)]
-        for d in self.heights.values():
-            if d < mn:
-                mn = d
-            if d > mx:
-                mx = d
-        r = mx - mn
-        f = 255 / r
-        for p in self.heights.keys():
-            self.heights[p] = (self.heights[p] - mn) * f
-
-    def render_blocks(self):
-        s = self.block_size
-        m = int(s / 2)
-        for xb in range(0, self.xb):
-            x = xb * s
-            for yb in range(0, self.yb):
-                y = yb * s
-                for corner in [(x, y), (x + s, y), (x, y + s), (x + s, y + s)]:
-                    if corner not in self.heights:
-                        self.heights[corner] = random.uniform(0, 256)
-                if (x + m, y + m) not in self.heights:
-                    self.cross_av(x + m, y + m, m)
-                self.mid_fill(x, y, s)
+
+    def generate(self, channels: int = 3) -> np.ndarray:
+        """stack of independent height maps, shaped (channels, rows + 1, cols + 1)"""
+        rng = np.random.default_rng(random.getrandbits(64))
+        step = self.block_size
+        heights = np.zeros((channels, self.yb * step + 1, self.xb * step + 1))
+        heights[:, ::step, ::step] = rng.uniform(0, 256, (channels, self.yb + 1, self.xb + 1))
+        return diamond_square(heights, step, rng)
+
+    @staticmethod
+    def normalise(heights: np.ndarray) -> np.ndarray:
+        """scale each channel to 0..255"""
+        low = heights.min(axis=(-2, -1), keepdims=True)
+        high = heights.max(axis=(-2, -1), keepdims=True)
+        return (heights - low) * (255 / np.maximum(high - low, 1e-9))
 
     def render(self) -> Image:
-        img = NewImage("RGB", (self.block_size * self.xb, self.block_size * self.yb))
-        draw = ImageDraw.Draw(img)
+        heights = self.normalise(self.generate(3))
+        return array_image(heights[:, :-1, :-1])
+
+
+class TiledPlasma:
+    """a plasma of any width and height, built a row of tiles at a time
+
+    Each corner, tile edge and tile interior has its own seed, derived from
+    the plasma's seed and its position, so neighbouring tiles agree on the
+    edges they share and any tile can be rebuilt on its own. That lets the
+    plasma be generated twice, once for each channel's range and once to
+    draw it, while only ever holding one row of tiles."""
+
+    CORNER, ACROSS, DOWN, INSIDE = range(4)
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        tile_size: int = 256,
+        seed: Optional[int] = None,
+        channels: int = 3,
+    ):
+        if tile_size < 2 or tile_size & (tile_size - 1):
+            raise ValueError(f"tile_size must be a power of two, not {tile_size}")
+        if width < 1 or height < 1:
+            raise ValueError(f"can't make a {width}x{height} plasma")
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.channels = channels
+        self.columns = -(-width // tile_size)
+        self.rows = -(-height // tile_size)
+        self._range: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def rng(self, kind: int, row: int, col: int) -> np.random.Generator:
+        """the random numbers for one part of the plasma"""
+        return np.random.default_rng([self.seed, kind, row, col])
+
+    def corner(self, row: int, col: int) -> np.ndarray:
+        """the value of each channel at the top left of tile (row, col)"""
+        return self.rng(self.CORNER, row, col).uniform(0, 256, self.channels)
+
+    def edge(self, kind: int, row: int, col: int) -> np.ndarray:
+        """midpoint displacement along the top (ACROSS) or left (DOWN)
+        edge of tile (row, col), shaped (channels, tile_size + 1)"""
+        size = self.tile_size
+        end = (row, col + 1) if kind == self.ACROSS else (row + 1, col)
+        line = np.empty((self.channels, size + 1))
+        line[:, 0] = self.corner(row, col)
+        line[:, -1] = self.corner(*end)
+        rng = self.rng(kind, row, col)
+        step = size
+        while step > 1:
+            half = step // 2
+            mids = (line[:, :-1:step] + line[:, step::step]) / 2
+            line[:, half::step] = mids + rng.normal(0, half, mids.shape)
+            step = half
+        return line
+
+    def tile(self, row: int, col: int) -> np.ndarray:
+        """heights for tile (row, col), shaped (channels, tile_size + 1, tile_size + 1)"""
+        size = self.tile_size
+        heights = np.empty((self.channels, size + 1, size + 1))
+        heights[:, 0, :] = self.edge(self.ACROSS, row, col)
+        heights[:, size, :] = self.edge(self.ACROSS, row + 1, col)
+        heights[:, :, 0] = self.edge(self.DOWN, row, col)
+        heights[:, :, size] = self.edge(self.DOWN, row, col + 1)
+        return diamond_square(heights, size, self.rng(self.INSIDE, row, col), True)
+
+    def bands(self) -> Iterator[np.ndarray]:
+        """heights a row of tiles at a time, cropped to the plasma,
+        shaped (channels, rows, width)"""
+        size = self.tile_size
+        for row in range(self.rows):
+            band = np.concatenate(
+                [self.tile(row, col)[:, :size, :size] for col in range(self.columns)],
+                axis=2,
+            )
+            yield band[:, : self.height - row * size, : self.width]
+
+    def channel_range(self) -> Tuple[np.ndarray, np.ndarray]:
+        """the lowest and highest height of each channel, from a first pass"""
+        if self._range is None:
+            low = np.full((self.channels, 1, 1), np.inf)
+            high = np.full((self.channels, 1, 1), -np.inf)
+            for band in self.bands():
+                low = np.minimum(low, band.min(axis=(1, 2), keepdims=True))
+                high = np.maximum(high, band.max(axis=(1, 2), keepdims=True))
+            self._range = (low, high)
+        return self._range
+
+    def pixels(self) -> Iterator[np.ndarray]:
+        """each row of tiles scaled to 0..255, shaped (channels, rows, width)"""
+        low, high = self.channel_range()
+        scale = 255 / np.maximum(high - low, 1e-9)
+        for band in self.bands():
+            yield ((band - low) * scale).astype(np.uint8)
+
+    def stream_png(self, fp: BinaryIO) -> None:
+        """write the plasma as an RGB PNG, a row of tiles at a time"""
+        with PngWriter(fp, (self.width, self.height), "RGB") as png:
+            for band in self.pixels():
+                png.write(band.transpose(1, 2, 0))
+
+    def render(self) -> Image:
+        return array_image(np.concatenate(list(self.pixels()), axis=1))
+
+
+class PaletteCycle:
+    """a single channel plasma kept as uint8 heights, coloured by
+    rotating a 256 colour palette through them"""
+
+    # colour stops for each palette, spread evenly around the cycle
+    palettes = {
+        "fire": [(0, 0, 0), (192, 0, 0), (255, 128, 0), (255, 255, 96), (255, 128, 0), (192, 0, 0)],
+        "ocean": [(0, 0, 64), (0, 64, 192), (0, 192, 224), (255, 255, 255), (0, 192, 224), (0, 64, 192)],
+        "rainbow": [(255, 0, 0), (255, 255, 0), (0, 255, 0), (0, 255, 255), (0, 0, 255), (255, 0, 255)],
+        "toxic": [(0, 32, 0), (64, 255, 0), (224, 255, 128), (64, 255, 0), (0, 32, 0), (128, 0, 160)],
+    }
+
+    def __init__(self, heights: np.ndarray):
+        self.heights = np.ascontiguousarray(heights, dtype=np.uint8)
 
-        self.reset()
-        self.render_blocks()
-        self.normalise()
-        red = dict(self.heights)
+    @classmethod
+    def generate(
+        cls, width: int = 256, height: int = 256, seed: Optional[int] = None
+    ) -> PaletteCycle:
+        """a new plasma, the same every time for a given seed"""
+        plasma = TiledPlasma(width, height, seed=seed, channels=1)
+        return cls(np.concatenate(list(plasma.pixels()), axis=1)[0])
 
-        self.reset()
-        self.render_blocks()
-        self.normalise()
-        green = dict(self.heights)
+    @classmethod
+    def cached(cls, width: int, height: int, seed: int) -> PaletteCycle:
+        """the plasma for seed, kept in the cache directory after the first time"""
+        path = cache_dir() / "plasma" / f"{seed}-{width}x{height}.npy"
+        if path.exists():
+            return cls(np.load(path))
+        plasma = cls.generate(width, height, seed)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+        np.save(temp, plasma.heights)
+        os.replace(temp, path)
+        return plasma
 
-        self.reset()
-        self.render_blocks()
-        self.normalise()
-        blue = dict(self.heights)
+    @classmethod
+    def palette(cls, name: str) -> np.ndarray:
+        """the named palette as 256 (r, g, b) rows, wrapping back to the start"""
+        stops = np.array(cls.palettes[name] + cls.palettes[name][:1], dtype=float)
+        where = np.linspace(0, 256, len(stops))
+        return np.stack(
+            [np.interp(np.arange(256), where, stops[:, x]) for x in range(3)], axis=1
+        ).astype(np.uint8)
 
-        for p in self.heights.keys():
-            draw.point([p], (int(red[p]), int(green[p]), int(blue[p])))
+    def render(self, name: str, shift: int = 0) -> Image:
+        """a still frame, with the palette rotated by shift"""
+        return array_image(self.heights, np.roll(self.palette(name), -shift, axis=0))
 
-        return img
+    def animate(
+        self,
+        name: str,
+        max_frames: int = 64,
+        max_bytes: int = 8 << 20,
+        delay: int = 50,
+    ) -> bytes:
+        """one full turn of the palette as an animated PNG, with at most
+        max_frames, halving the frame count until it fits in max_bytes"""
+        height, width = self.heights.shape
+        palette = self.palette(name).tobytes()
+        frames = max(1, min(max_frames, 256))
+        while True:
+            png = ApngWriter((width, height), palette)
+            for frame in range(frames):
+                # rotating the palette is the same as adding to every index
+                png.add_frame(self.heights + np.uint8(frame * 256 // frames), delay=delay)
+                if png.size > max_bytes and frames > 1:
+                    break
+            else:
+                return png.getvalue()
+            frames //= 2
 
 
 if __name__ == "__main__":
@@ -1,93 +1,501 @@
 """fractal tree generation"""
 
+from __future__ import annotations
+
+import functools
 import logging
 import math
 import random
-from argparse import Namespace
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
+import numpy as np
 from PIL import ImageDraw
-from PIL.Image import Image
+from PIL.Image import Image, fromarray
 from PIL.Image import new as NewImage
 
 try:
-    from hashamatic.command import BotCmd, BotResult, iRandom
+    from hashamatic.command import BotCmd, BotResult, iRandom, iWallpaper
 
-    class Tree(BotCmd, iRandom):
+    class Tree(BotCmd, iRandom, iWallpaper):
         """A fractal tree."""
 
         tags: list[str] = ["tree", "🌳", "ProcGen", "art", "botArt"]
         caption = "Look at this tree I grew. 🌳"
 
-        def run(self, _args: Namespace) -> BotResult:
+        @staticmethod
+        def add_argparse_arguments(parser: ArgumentParser) -> ArgumentParser:
+            parser.add_argument(
+                "--style",
+                choices=["fractal", "colonization"],
+                default=None,
+                help="split branches at fixed angles, or grow them towards a crown of points",
+            )
+            parser.add_argument(
+                "--attractors",
+                type=int,
+                default=2000,
+                help="points in the crown for the colonization style",
+            )
+            parser.add_argument(
+                "--forest",
+                type=int,
+                default=None,
+                metavar="TREES",
+                help="grow a forest of this many trees",
+            )
+            parser.add_argument(
+                "--seed", type=int, default=None, help="which forest to grow"
+            )
+            parser.add_argument(
+                "--workers",
+                type=int,
+                default=None,
+                help="processes to grow the forest's trees in",
+            )
+            return parser
+
+        def run(self, args: Namespace) -> BotResult:
+            if args.forest:
+                forest = Forest(1024, 1024, args.forest, args.seed, args.style)
+                return BotResult(
+                    forest.render(args.workers),
+                    text=self.caption,
+                    tags=self.tags,
+                    alt_text=f"A computer generated forest of {args.forest} trees",
+                )
+            style = args.style or random.choice(["fractal", "colonization"])
+            if style == "colonization":
+                tree: FractalTree | ColonizedTree = ColonizedTree(
+                    attractors=args.attractors
+                )
+                alt_text = "A computer generated tree, grown by space colonization"
+            else:
+                tree = FractalTree()
+                alt_text = "A computer generated fractal tree"
             return BotResult(
-                FractalTree().render(),
+                tree.render(),
                 text=self.caption,
                 tags=self.tags,
-                alt_text="A computer generated fractal tree",
+                alt_text=alt_text,
+            )
+
+        def wallpaper(self) -> BotResult:
+            forest = Forest(1080, 2400, 24)
+            return BotResult(
+                forest.render(),
+                text=self.caption,
+                tags=self.tags,
+                alt_text="A computer generated forest of 24 trees",
             )
 
 except ImportError:
     logging.debug("failed to import BotCmd interface")
 
 
+@functools.lru_cache(maxsize=None)
+def leaf_sprite(size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(dy, dx) offsets of the pixels in a leaf of radius size / 2"""
+    radius = size / 2
+    span = math.ceil(radius) + 1
+    img = NewImage("L", (2 * span + 1, 2 * span + 1))
+    ImageDraw.Draw(img).regular_polygon((span, span, radius), n_sides=7, fill=255)
+    ys, xs = np.nonzero(np.asarray(img))
+    return ys - span, xs - span
+
+
+@functools.lru_cache(maxsize=None)
+def brush(width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(dy, dx) offsets of the pixels in a round brush width pixels across"""
+    if width == 1:
+        # PIL draws nothing for an ellipse a single pixel across
+        return np.zeros(1, dtype=int), np.zeros(1, dtype=int)
+    img = NewImage("L", (width, width))
+    ImageDraw.Draw(img).ellipse((0, 0, width - 1, width - 1), fill=255)
+    ys, xs = np.nonzero(np.asarray(img))
+    return ys - (width - 1) // 2, xs - (width - 1) // 2
+
+
+def stamp(
+    pixels: np.ndarray,
+    centres: np.ndarray,
+    sprite: Tuple[np.ndarray, np.ndarray],
+    colours: np.ndarray,
+):
+    """paint a sprite at each (x, y) centre, in each row's colour"""
+    height, width = pixels.shape[:2]
+    ys = centres[:, 1, np.newaxis] + sprite[0]
+    xs = centres[:, 0, np.newaxis] + sprite[1]
+    colours = np.broadcast_to(colours[:, np.newaxis], ys.shape + (pixels.shape[2],))
+    inside = (ys >= 0) & (ys < height) & (xs >= 0) & (xs < width)
+    pixels[ys[inside], xs[inside]] = colours[inside]
+
+
+class TreeGeometry:
+    """a grown tree as flat arrays: segments (n, 4) of x0, y0, x1, y1 with
+    their widths, and leaves (m, 2) with their radii and shades of green"""
+
+    bark = (126, 46, 31)
+
+    def __init__(
+        self,
+        segments: np.ndarray,
+        widths: np.ndarray,
+        leaves: np.ndarray,
+        radii: np.ndarray,
+        greens: np.ndarray,
+    ):
+        self.segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        self.widths = np.asarray(widths, dtype=float)
+        self.leaves = np.asarray(leaves, dtype=float).reshape(-1, 2)
+        self.radii = np.asarray(radii, dtype=float)
+        self.greens = np.asarray(greens, dtype=np.uint8)
+
+    def draw(
+        self, img: Image, scale: float = 1.0, offset: Tuple[float, float] = (0, 0)
+    ) -> Image:
+        """draw onto an RGB image, scaled then moved by offset: the branches
+        of each width are brushed along in one go, then leaves stamped on"""
+        pixels = np.array(img)
+        segments = self.segments * scale + np.tile(offset, 2)
+        widths = np.maximum(1, np.rint(self.widths * scale)).astype(int)
+        bark = np.array([self.bark], dtype=np.uint8)
+        for width in np.unique(widths):
+            group = segments[widths == width]
+            # points along each segment, no more than a pixel apart
+            steps = np.ceil(np.hypot(*(group[:, 2:] - group[:, :2]).T)).astype(int) + 1
+            which = np.repeat(np.arange(len(group)), steps)
+            first = np.cumsum(steps) - steps
+            along = (np.arange(len(which)) - first[which]) / np.maximum(steps - 1, 1)[which]
+            start = group[which, :2]
+            points = start + (group[which, 2:] - start) * along[:, np.newaxis]
+            stamp(pixels, np.floor(points).astype(int), brush(int(width)), bark)
+
+        centres = np.rint(self.leaves * scale + offset).astype(int)
+        sizes = np.maximum(1, np.rint(self.radii * scale * 2)).astype(int)
+        colours = np.zeros((len(self.leaves), 3), dtype=np.uint8)
+        colours[:, 1] = self.greens
+        for size in np.unique(sizes):
+            which = sizes == size
+            stamp(pixels, centres[which], leaf_sprite(int(size)), colours[which])
+        img.paste(fromarray(pixels, img.mode))
+        return img
+
+
 class FractalTree:
     """class to generate fractal trees"""
 
-    def __init__(self):
-        self.w = self.h = 1024
+    def __init__(self, size: int = 1024, length: float = 100):
+        self.w = self.h = size
+        self.length = length
         self.r = 10
         self.spread = 30
         self.lr = (-5, 3)
         self.la = (-5, 5)
-        self.leaves: set[tuple[float, float]] = set()  # type: ignore
+        self.geometry: Optional[TreeGeometry] = None
 
-    def branch(
+    def grow(
         self,
-        draw: ImageDraw.ImageDraw,
-        angle: float,
-        base: tuple[float, float],
-        length: float,
-        depth: int = 1,
+        angle: float = -180,
+        base: Optional[Tuple[float, float]] = None,
+    ) -> TreeGeometry:
+        """grow the tree's branches and leaves, depth first from an explicit
+        stack, taking random numbers in the same order as recursing would"""
+        if base is None:
+            base = (self.w / 2, self.h * 9 / 10)
+        segments: List[Tuple[float, float, float, float]] = []
+        widths: List[int] = []
+        leaves: dict[Tuple[float, float], None] = {}
+        # each entry is a branch still to finish: its tip, angle, the length
+        # of its children, its depth and how many children it has so far
+        stack: List[list] = []
+
+        def branch(angle: float, base: Tuple[float, float], length: float, depth: int):
+            tip = (
+                base[0] + length * math.sin(math.radians(angle)),
+                base[1] + length * math.cos(math.radians(angle)),
+            )
+            segments.append((*base, *tip))
+            widths.append(1 + int(length / 10))
+            length = length - self.r
+            if length > 5:
+                stack.append([tip, angle, length, depth, 0])
+            else:
+                leaves[tip] = None
+
+        branch(angle, base, self.length, 1)
+        while stack:
+            top = stack[-1]
+            tip, angle, length, depth, children = top
+            if children == 0:
+                turn = self.spread
+            elif children == 1:
+                turn = -self.spread
+            elif children == 2 and random.randint(0, depth + 1) < 2:
+                turn = 0
+            else:
+                stack.pop()
+                continue
+            top[4] += 1
+            lp = length + random.uniform(*self.lr)
+            ap = angle + turn + random.uniform(*self.la)
+            branch(ap, tip, lp, depth + 1)
+
+        greens = [int(random.uniform(128, 224)) for _ in leaves]
+        radii = [random.uniform(3, 6) for _ in leaves]
+        self.geometry = TreeGeometry(segments, widths, list(leaves), radii, greens)
+        return self.geometry
+
+    def render(self, scale: float = 1.0) -> Image:
+        """render the tree to a PIL.Image, growing it first if need be;
+        the same tree can be rendered again at another scale"""
+        if self.geometry is None:
+            self.grow()
+        assert self.geometry is not None
+        img = NewImage("RGB", (round(self.w * scale), round(self.h * scale)))
+        return self.geometry.draw(img, scale)
+
+
+class AttractorGrid:
+    """uniform grid over some of a set of attractor points, in square cells
+    radius wide, so everything within radius of a point is in the 3x3
+    cells around it"""
+
+    def __init__(
+        self, points: np.ndarray, radius: float, which: Optional[np.ndarray] = None
+    ):
+        self.points = points
+        self.radius = radius
+        if which is None:
+            which = np.arange(len(points))
+        self.size = len(which)
+        self.origin = points.min(axis=0)
+        cells = np.floor((points[which] - self.origin) / radius).astype(int)
+        self.shape = tuple(np.floor((points.max(axis=0) - self.origin) / radius).astype(int) + 1)
+        # attractors sorted by cell, each cell's run found from its id
+        ids = cells[:, 1] * self.shape[0] + cells[:, 0]
+        self.order = which[np.argsort(ids, kind="stable")]
+        counts = np.bincount(ids, minlength=self.shape[0] * self.shape[1])
+        self.starts = np.cumsum(counts) - counts
+        self.counts = counts
+
+    def near(self, centres: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(centre, attractor) index pairs less than radius apart"""
+        cells = np.floor((centres - self.origin) / self.radius).astype(int)
+        found_c: List[np.ndarray] = []
+        found_a: List[np.ndarray] = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                cx = cells[:, 0] + dx
+                cy = cells[:, 1] + dy
+                ok = (cx >= 0) & (cx < self.shape[0]) & (cy >= 0) & (cy < self.shape[1])
+                which = np.nonzero(ok)[0]
+                ids = cy[which] * self.shape[0] + cx[which]
+                counts = self.counts[ids]
+                centre = np.repeat(which, counts)
+                first = np.repeat(np.cumsum(counts) - counts, counts)
+                slot = np.repeat(self.starts[ids], counts) + np.arange(len(centre)) - first
+                found_c.append(centre)
+                found_a.append(self.order[slot])
+        centre = np.concatenate(found_c)
+        attractor = np.concatenate(found_a)
+        gap = np.hypot(*(self.points[attractor] - centres[centre]).T)
+        close = gap < self.radius
+        return centre[close], attractor[close]
+
+
+class ColonizedTree:
+    """class to grow trees by space colonization: branches grow a step at a
+    time towards the attractor points scattered through an oval crown,
+    and attractors are used up once a branch reaches them"""
+
+    def __init__(
+        self,
+        size: int = 1024,
+        attractors: int = 2000,
+        step: float = 5,
+        influence: float = 64,
+        kill: float = 10,
     ):
-        """branch a trunk"""
+        self.w = self.h = size
+        self.attractors = attractors
+        self.step = step
+        self.influence = influence
+        self.kill = kill
+        self.max_width = 11
+        self.twig = 4
+        self.max_iterations = 1000
+        self.geometry: Optional[TreeGeometry] = None
 
-        e = (
-            length * math.sin(math.radians(angle)),
-            length * math.cos(math.radians(angle)),
+    def crown(self, rng: np.random.Generator) -> np.ndarray:
+        """attractor points spread evenly through an oval crown"""
+        radius = np.sqrt(rng.random(self.attractors))
+        angle = rng.uniform(0, 2 * math.pi, self.attractors)
+        centre = (self.w / 2, self.h * 9 / 20)
+        return np.column_stack(
+            (
+                centre[0] + radius * np.cos(angle) * self.w * 2 / 5,
+                centre[1] + radius * np.sin(angle) * self.h * 3 / 10,
+            )
         )
-        f = (base[0] + e[0], base[1] + e[1])
-        draw.line([base, f], fill="rgb(126, 46, 31)", width=1 + int(length / 10))
-        length = length - self.r
-        if length > 5:
-            lp = length + random.uniform(*self.lr)
-            ap = angle + self.spread + random.uniform(*self.la)
-            self.branch(draw, ap, f, lp, depth + 1)
-            lp = length + random.uniform(*self.lr)
-            ap = angle - self.spread + random.uniform(*self.la)
-            self.branch(draw, ap, f, lp, depth + 1)
-            if random.randint(0, depth + 1) < 2:
-                lp = length + random.uniform(*self.lr)
-                ap = angle + random.uniform(*self.la)
-                self.branch(draw, ap, f, lp, depth + 1)
-        else:
-            self.leaves.add(f)
-
-    def render(self) -> Image:
-        """render the tree to a PIL.Image"""
-        img = NewImage("RGB", (self.w, self.h))
-        draw = ImageDraw.Draw(img)
-
-        angle = -180
-        base = (self.w / 2, self.h * 9 / 10)
-        length = 100
-
-        self.leaves.clear()
-        self.branch(draw, angle, base, length)
-        for point in self.leaves:
-            green: int = int(random.uniform(128, 224))
-            draw.regular_polygon(
-                (*point, random.uniform(3, 6)), n_sides=7, fill=f"rgb(0, {green}, 0)"
+
+    def grow(self, base: Optional[Tuple[float, float]] = None) -> TreeGeometry:
+        """grow the tree's branches and leaves up from the base; each
+        attractor remembers its nearest node, so only the nodes added in a
+        step are looked up in the attractor grid"""
+        if base is None:
+            base = (self.w / 2, self.h * 9 / 10)
+        rng = np.random.default_rng(random.getrandbits(64))
+        points = self.crown(rng)
+        grid = AttractorGrid(points, self.influence)
+        alive = np.ones(len(points), dtype=bool)
+        nearest = np.full(len(points), -1)
+        distance = np.full(len(points), np.inf)
+
+        nodes = np.array([base], dtype=float)
+        parents = np.array([-1])
+        generations = np.array([0])
+        fresh = np.array([0])
+        for generation in range(1, self.max_iterations + 1):
+            node, attractor = grid.near(nodes[fresh])
+            node = fresh[node]
+            gap = np.hypot(*(points[attractor] - nodes[node]).T)
+            useful = gap < distance[attractor]
+            node, attractor, gap = node[useful], attractor[useful], gap[useful]
+            # keep the closest new node for each attractor, if nearer than before
+            best = np.lexsort((gap, attractor))
+            first = np.ones(len(best), dtype=bool)
+            first[1:] = attractor[best][1:] != attractor[best][:-1]
+            best = best[first]
+            closer = gap[best] < distance[attractor[best]]
+            nearest[attractor[best][closer]] = node[best][closer]
+            distance[attractor[best][closer]] = gap[best][closer]
+            alive &= distance >= self.kill
+            if alive.sum() < grid.size // 2:
+                # leave the used up attractors out of later lookups
+                grid = AttractorGrid(points, self.influence, np.nonzero(alive)[0])
+
+            pulled = np.nonzero(alive & (nearest >= 0))[0]
+            if len(pulled) == 0:
+                if (nearest >= 0).any():
+                    break
+                # no attractors in reach yet, so grow the trunk straight up
+                tips = fresh[-1:]
+                directions = np.array([[0.0, -1.0]])
+            else:
+                pulls = points[pulled] - nodes[nearest[pulled]]
+                pulls /= np.hypot(*pulls.T)[:, np.newaxis]
+                tips, where = np.unique(nearest[pulled], return_inverse=True)
+                directions = np.zeros((len(tips), 2))
+                np.add.at(directions, where, pulls)
+                # a nudge breaks ties between attractors pulling opposite ways
+                directions += rng.normal(0, 0.05, directions.shape)
+                directions /= np.hypot(*directions.T)[:, np.newaxis]
+            fresh = np.arange(len(nodes), len(nodes) + len(tips))
+            nodes = np.concatenate((nodes, nodes[tips] + directions * self.step))
+            parents = np.concatenate((parents, tips))
+            generations = np.concatenate((generations, np.full(len(tips), generation)))
+
+        # pipe model: a branch is as thick as all the twigs it carries
+        weights = np.ones(len(nodes))
+        for generation in range(generations[-1], 0, -1):
+            which = np.nonzero(generations == generation)[0]
+            np.add.at(weights, parents[which], weights[which])
+        child = np.arange(1, len(nodes))
+        segments = np.column_stack((nodes[parents[child]], nodes[child]))
+        widths = 1 + (self.max_width - 1) * np.sqrt(weights[child] / weights[0])
+
+        # leaves all along the last few steps of every twig
+        tips = child[weights[child] <= self.twig]
+        greens = rng.uniform(128, 224, len(tips)).astype(int)
+        radii = rng.uniform(3, 6, len(tips))
+        self.geometry = TreeGeometry(segments, widths, nodes[tips], radii, greens)
+        return self.geometry
+
+    def render(self, scale: float = 1.0) -> Image:
+        """render the tree to a PIL.Image, growing it first if need be"""
+        if self.geometry is None:
+            self.grow()
+        assert self.geometry is not None
+        img = NewImage("RGB", (round(self.w * scale), round(self.h * scale)))
+        return self.geometry.draw(img, scale)
+
+
+def grown_tree(style: str, depth: float, seed: int) -> TreeGeometry:
+    """grow one tree from its own seed, for use by pool workers"""
+    random.seed(seed)
+    if style == "colonization":
+        return ColonizedTree(attractors=int(depth)).grow()
+    return FractalTree(length=depth).grow()
+
+
+class Forest:
+    """class to grow many trees and stand them together, the furthest away
+    highest up, smallest and drawn first"""
+
+    size = 1024  # each tree is grown on a square this big then scaled
+
+    def __init__(
+        self,
+        width: int = 1080,
+        height: int = 2400,
+        trees: int = 24,
+        seed: Optional[int] = None,
+        style: Optional[str] = None,
+    ):
+        self.w = width
+        self.h = height
+        self.trees = trees
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.style = style
+
+    def plan(self) -> List[Tuple[float, float, float, str, float, int]]:
+        """(x, y, scale, style, depth, seed) for each tree, back to front;
+        all drawn from the forest's seed so the plan never changes"""
+        rng = random.Random(self.seed)
+        trees = []
+        for _ in range(self.trees):
+            near = rng.random()
+            style = self.style or rng.choice(["fractal", "colonization"])
+            if style == "colonization":
+                depth = rng.uniform(500, 2000)
+            else:
+                depth = rng.uniform(70, 100)
+            trees.append(
+                (
+                    rng.uniform(0, self.w),
+                    self.h * (0.3 + 0.65 * near),
+                    self.w / self.size * (0.25 + 0.55 * near),
+                    style,
+                    depth,
+                    rng.getrandbits(32),
+                )
             )
+        return sorted(trees, key=lambda x: x[1])
+
+    def grow(self, workers: Optional[int] = None) -> List[TreeGeometry]:
+        """grow every tree across a process pool; each has its own seed, so
+        the forest comes out the same however many workers there are"""
+        plan = self.plan()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(
+                pool.map(
+                    grown_tree,
+                    [x[3] for x in plan],
+                    [x[4] for x in plan],
+                    [x[5] for x in plan],
+                )
+            )
+
+    def render(self, workers: Optional[int] = None) -> Image:
+        """render the forest to a PIL.Image, painting nearer trees over
+        the ones behind"""
+        img = NewImage("RGB", (self.w, self.h))
+        for (x, y, scale, *_), geometry in zip(self.plan(), self.grow(workers)):
+            # trees are grown with their base at (size / 2, size * 9 / 10)
+            offset = (x - scale * self.size / 2, y - scale * self.size * 9 / 10)
+            geometry.draw(img, scale, offset)
         return img
 
 
@@ -0,0 +1,229 @@
+"""compiled, memory-mapped word lists shared by the word game commands
+
+The compiled file (little endian) is laid out as:
+
+    header      magic, version, source size/mtime, counts (see HEADER)
+    buckets     (offset, count) for each word length 0..maxlen
+    words       per length, sorted fixed width latin-1 uppercase records
+    nodes       (first edge, edge count, terminal) for each DAWG node
+    children    child node index for each edge
+    chars       edge character for each edge, sorted within a node
+
+The DAWG is the prefix index: walk it a character at a time with
+child() to test prefixes without materialising any words.
+"""
+
+from __future__ import annotations
+
+import functools
+import importlib.resources
+import logging
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from hashamatic.cache import cache_dir
+
+MAGIC = b"HLEX"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQIIII")
+BUCKET = struct.Struct("<II")
+NODE = struct.Struct("<IHH")
+CHILD = struct.Struct("<I")
+ENCODING = "latin-1"
+
+_BYTES = [bytes([x]) for x in range(256)]
+
+
+def _source_stamp(source: Path) -> Tuple[int, int]:
+    """size and mtime used to spot a changed word list"""
+    stat = source.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def compile_lexicon(source: Path, target: Path) -> None:
+    """compile a one word per line text file into a lexicon file"""
+    words = sorted(
+        {
+            x.strip().upper().encode(ENCODING)
+            for x in source.read_text(encoding="utf8").splitlines()
+            if x.strip()
+        }
+    )
+    maxlen = max(len(x) for x in words)
+
+    # build a trie, then merge identical suffixes bottom up into a DAWG
+    trie: Dict[bytes, dict] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(_BYTES[ch], {})
+        node[b""] = {}
+
+    nodes: List[Tuple[int, int, int]] = []
+    children: List[int] = []
+    chars = bytearray()
+    seen: Dict[tuple, int] = {}
+
+    def add(node: Dict[bytes, dict]) -> int:
+        edges = tuple((ch, add(child)) for ch, child in sorted(node.items()) if ch)
+        key = (b"" in node, edges)
+        if key not in seen:
+            seen[key] = len(nodes)
+            nodes.append((len(children), len(edges), int(key[0])))
+            for ch, child in edges:
+                chars.extend(ch)
+                children.append(child)
+        return seen[key]
+
+    root = add(trie)
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with temp.open("wb") as out:
+        size, mtime = _source_stamp(source)
+        out.write(
+            HEADER.pack(
+                MAGIC, VERSION, maxlen, size, mtime,
+                len(words), len(nodes), len(children), root,
+            )
+        )
+        offset = HEADER.size + BUCKET.size * (maxlen + 1)
+        buckets: List[List[bytes]] = [[] for _ in range(maxlen + 1)]
+        for word in words:
+            buckets[len(word)].append(word)
+        for length, bucket in enumerate(buckets):
+            out.write(BUCKET.pack(offset, len(bucket)))
+            offset += length * len(bucket)
+        for bucket in buckets:
+            out.write(b"".join(bucket))
+        for node in nodes:
+            out.write(NODE.pack(*node))
+        for child in children:
+            out.write(CHILD.pack(child))
+        out.write(chars)
+    os.replace(temp, target)
+    logging.info(
+        "compiled %s: %d words, %d nodes -> %s", source, len(words), len(nodes), target
+    )
+
+
+class Lexicon:
+    """read only view of a compiled lexicon file"""
+
+    def __init__(self, path: Path):
+        with path.open("rb") as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, version, self.maxlen, self.source_size, self.source_mtime,
+            self.count, nodes, edges, self.root,
+        ) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} lexicon")
+        self.buckets = [
+            BUCKET.unpack_from(self.mm, HEADER.size + BUCKET.size * x)
+            for x in range(self.maxlen + 1)
+        ]
+        self.nodes_offset = HEADER.size + BUCKET.size * (self.maxlen + 1)
+        self.nodes_offset += sum(x * count for x, (_, count) in enumerate(self.buckets))
+        self.children_offset = self.nodes_offset + NODE.size * nodes
+        self.chars_offset = self.children_offset + CHILD.size * edges
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, word: object) -> bool:
+        if not isinstance(word, str) or len(word) > self.maxlen:
+            return False
+        try:
+            key = word.upper().encode(ENCODING)
+        except UnicodeEncodeError:
+            return False
+        length = len(key)
+        offset, count = self.buckets[length]
+        low, high = 0, count
+        while low < high:
+            mid = (low + high) // 2
+            start = offset + mid * length
+            probe = self.mm[start : start + length]
+            if probe == key:
+                return True
+            if probe < key:
+                low = mid + 1
+            else:
+                high = mid
+        return False
+
+    def words(self, length: Optional[int] = None) -> Iterator[str]:
+        """iterate the words, optionally of a single length"""
+        lengths: Iterable[int] = range(1, self.maxlen + 1)
+        if length is not None:
+            lengths = [length] if 0 < length <= self.maxlen else []
+        for size in lengths:
+            offset, count = self.buckets[size]
+            for start in range(offset, offset + size * count, size):
+                yield self.mm[start : start + size].decode(ENCODING)
+
+    def child(self, node: int, ch: str) -> int:
+        """follow the edge for ch out of node, -1 if there isn't one"""
+        code = ord(ch)
+        if code > 255:
+            return -1
+        first, count, _ = NODE.unpack_from(self.mm, self.nodes_offset + NODE.size * node)
+        start = self.chars_offset + first
+        edge = self.mm.find(_BYTES[code], start, start + count)
+        if edge < 0:
+            return -1
+        return CHILD.unpack_from(
+            self.mm, self.children_offset + CHILD.size * (edge - self.chars_offset)
+        )[0]
+
+    def is_word(self, node: int) -> bool:
+        """true if a word ends at node"""
+        return bool(NODE.unpack_from(self.mm, self.nodes_offset + NODE.size * node)[2])
+
+    def find(self, prefix: str) -> int:
+        """node reached by prefix, -1 if no word starts with it"""
+        node = self.root
+        for ch in prefix.upper():
+            node = self.child(node, ch)
+            if node < 0:
+                break
+        return node
+
+    def has_prefix(self, prefix: str) -> bool:
+        """true if any word starts with prefix"""
+        return self.find(prefix) >= 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_lexicon(name: str = "words.txt") -> Lexicon:
+    """returns the lexicon for a word list in hashamatic.resources,
+    compiling it first if it is missing or out of date"""
+    target = cache_dir() / f"{Path(name).stem}.lex"
+    with importlib.resources.as_file(
+        importlib.resources.files("hashamatic.resources").joinpath(name)
+    ) as source:
+        if target.exists():
+            try:
+                lexicon = Lexicon(target)
+            except (ValueError, OSError, struct.error) as e:
+                logging.warning("%s is unreadable, recompiling: %s", target, e)
+            else:
+                if (lexicon.source_size, lexicon.source_mtime) == _source_stamp(source):
+                    return lexicon
+                logging.info("%s has changed, recompiling", name)
+        compile_lexicon(source, target)
+    return Lexicon(target)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, force=True)
+    if len(sys.argv) == 3:
+        compile_lexicon(Path(sys.argv[1]), Path(sys.argv[2]))
+    else:
+        lex = get_lexicon()
+        logging.info("%d words, longest %d", len(lex), lex.maxlen)